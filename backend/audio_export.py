@@ -1,10 +1,178 @@
+"""
+Batch export of FLAC tracks to lossy format, files encoded in parallel by process pool
+
+Export skipped if target is newer than source or source content is unchanged since last export,
+source content hashes kept at manifest file next to exported files::
+
+    python audio_export.py
+    python audio_export.py 'music_room/music/*.flac' --format opus --bitrate 96 --processes 4
+    python audio_export.py --force
+
+Encoding (:func:`export_file`) and hashing (:func:`file_hash`) reused by transcoding service.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
 from glob import glob
+from typing import Dict, Iterable, Iterator, Optional, Tuple
 
 from pydub import AudioSegment
 
+MANIFEST_NAME = '.audio_export.json'  #: Manifest file name, stored at directory of exported files
+
+
+def file_hash(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of file content, read by chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def export_file(source: str, target: str, extension: str, bitrate: Optional[int] = None,
+                source_format: Optional[str] = None) -> str:
+    """Encode source to target, written to temporary file first so interrupted export leaves no partial target"""
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(target) or '.', suffix=f'.{extension}', delete=False) as file:
+        temporary_path = file.name
+    try:
+        AudioSegment.from_file(source, source_format).export(
+            temporary_path, format=extension, bitrate=f'{bitrate}k' if bitrate else None
+        )
+        os.replace(temporary_path, target)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+    return target
+
+
+def is_up_to_date(source: str, target: str, exported_hash: Optional[str] = None) -> Tuple[bool, Optional[str]]:
+    """
+    Target is up to date if it is newer than source or source hash equals hash of exported source,
+    second value is source hash if it was computed
+    """
+    if not os.path.exists(target):
+        return False, None
+    if os.path.getmtime(target) >= os.path.getmtime(source):
+        return True, None
+    if not exported_hash:
+        return False, None
+    content_hash = file_hash(source)
+    return content_hash == exported_hash, content_hash
+
+
+@dataclass
+class ExportResult:
+    source: str  #: Source file path
+    target: str  #: Exported file path
+    exported: bool  #: False if target was up to date
+    content_hash: Optional[str] = None  #: Source hash, None if not computed
+    size: int = 0  #: Source size in bytes
+    error: Optional[str] = None  #: Error if export failed
+
+
+def export_job(source: str, target: str, extension: str, bitrate: Optional[int],
+               exported_hash: Optional[str], force: bool) -> ExportResult:
+    """Export source if target is not up to date, run at process pool"""
+    size = os.path.getsize(source)
+    try:
+        if not force:
+            up_to_date, content_hash = is_up_to_date(source, target, exported_hash)
+            if up_to_date:
+                return ExportResult(source, target, exported=False, content_hash=content_hash or exported_hash, size=size)
+        export_file(source, target, extension, bitrate)
+        return ExportResult(source, target, exported=True, content_hash=file_hash(source), size=size)
+    except Exception as e:
+        return ExportResult(source, target, exported=False, size=size, error=repr(e))
+
+
+class Manifest:
+    """Source hashes of exported files by target path relative to manifest"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.directory = os.path.dirname(path) or '.'
+        try:
+            with open(path) as file:
+                self.hashes: Dict[str, str] = json.load(file)
+        except (FileNotFoundError, ValueError):
+            self.hashes = {}
+
+    def key(self, target: str) -> str:
+        return os.path.relpath(target, self.directory)
+
+    def get(self, target: str) -> Optional[str]:
+        return self.hashes.get(self.key(target))
+
+    def set(self, target: str, content_hash: str):
+        self.hashes[self.key(target)] = content_hash
+
+    def save(self):
+        with tempfile.NamedTemporaryFile('w', dir=self.directory, delete=False) as file:
+            json.dump(self.hashes, file, indent=1, sort_keys=True)
+        os.replace(file.name, self.path)
+
+
+def target_path(source: str, extension: str) -> str:
+    return f'{os.path.splitext(source)[0]}.{extension}'
+
+
+def export_all(sources: Iterable[str], extension: str = 'mp3', bitrate: Optional[int] = None,
+               processes: Optional[int] = None, manifest: Optional[Manifest] = None,
+               force: bool = False) -> Iterator[ExportResult]:
+    """Export sources by process pool, results yielded as they complete, manifest saved at the end"""
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [
+            pool.submit(
+                export_job, source, target_path(source, extension), extension, bitrate,
+                manifest.get(target_path(source, extension)) if manifest else None, force
+            ) for source in sources
+        ]
+        try:
+            for future in as_completed(futures):
+                result = future.result()
+                if manifest and result.content_hash:
+                    manifest.set(result.target, result.content_hash)
+                yield result
+        finally:
+            if manifest:
+                manifest.save()
+
+
 if __name__ == '__main__':
-    files = glob('music_room/music/*.flac')
-    for file in files:
-        flac_audio = AudioSegment.from_file(file, 'flac')
-        flac_audio.export(file.replace('.flac', '.mp3'), format='mp3')
-        print('+', file, 'Exported')
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('pattern', nargs='?', default='music_room/music/*.flac', help='Glob pattern of source files.')
+    parser.add_argument('--format', default='mp3', help='Exported file format.')
+    parser.add_argument('--bitrate', type=int, help='Exported file bitrate in kbps, encoder default if not set.')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='Parallel encoding processes.')
+    parser.add_argument('--force', action='store_true', help='Export files even if up to date.')
+    args = parser.parse_args()
+
+    files = sorted(glob(args.pattern, recursive=True))
+    manifest = Manifest(os.path.join(os.path.dirname(files[0]) if files else '.', MANIFEST_NAME))
+    exported, skipped, failed, exported_size = 0, 0, 0, 0
+    started = time.perf_counter()
+    for result in export_all(files, args.format, args.bitrate, args.processes, manifest, args.force):
+        if result.error:
+            failed += 1
+            print('!', result.source, result.error)
+        elif result.exported:
+            exported += 1
+            exported_size += result.size
+            print('+', result.source, 'Exported')
+        else:
+            skipped += 1
+            print('=', result.source, 'Up to date')
+    elapsed = time.perf_counter() - started
+    print(
+        f'{exported} exported, {skipped} up to date, {failed} failed in {elapsed:.1f} s, '
+        f'{exported / elapsed if elapsed else 0:.2f} files/s, '
+        f'{exported_size / 1024 / 1024 / elapsed if elapsed else 0:.1f} MB/s of source'
+    )
+    sys.exit(1 if failed else 0)
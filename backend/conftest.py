@@ -0,0 +1,8 @@
+import pytest
+
+
+@pytest.fixture(scope='session')
+def django_db_modify_db_settings(tmp_path_factory):
+    """Test database at file instead of memory, so concurrent connections of test threads wait for each other locks"""
+    from django.db import connections
+    connections['default'].settings_dict['TEST']['NAME'] = str(tmp_path_factory.mktemp('db') / 'test.sqlite3')
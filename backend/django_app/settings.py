@@ -131,12 +131,61 @@ BOOTSTRAP_PRUNE = True
 
 ASGI_APPLICATION = 'django_app.asgi.application'
 
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+#: Redis for channel layer and cache, required to run more than one worker
+REDIS_URL = os.getenv('REDIS_URL')
+
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": [REDIS_URL],
+            },
+        }
+    }
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
     }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer"
+        }
+    }
+
+#: Player queue shared between workers, flushed on every change instead of write-behind
+PLAYER_QUEUE_SHARED = bool(REDIS_URL)
+
+#: Seconds of client and server track progress difference ignored by sync track
+PLAYER_DRIFT_TOLERANCE = 2
+
+#: Integrated loudness in LUFS track file gain normalizes to
+PLAYER_TARGET_LOUDNESS = -14
+
+#: Transcoding queue, ``database`` processed by ``transcode_worker`` command, ``local`` processed in process
+TRANSCODING_QUEUE = os.getenv('TRANSCODING_QUEUE', 'database')
+
+#: Rendition ladder exported from lossless track files
+TRANSCODING_RENDITIONS = [
+    {'extension': 'mp3', 'bitrate': 64},
+    {'extension': 'mp3', 'bitrate': 128},
+    {'extension': 'mp3', 'bitrate': 320},
+    {'extension': 'opus', 'bitrate': 96},
+]
+
+#: HLS packaging of lossless track files, fixed duration AAC segments and manifest
+TRANSCODING_SEGMENTS = {
+    'enabled': os.getenv('TRANSCODING_SEGMENTS', '0') == '1',
+    'duration': 6,  #: Segment duration in seconds
+    'bitrate': 128,  #: Segments bitrate in kbps
 }
 
+#: Processes encoding renditions of one track file in parallel
+TRANSCODING_PROCESSES = int(os.getenv('TRANSCODING_PROCESSES', os.cpu_count() or 1))
+
 AUTH_USER_MODEL = 'music_room.User'
 
 import django_on_heroku
@@ -169,7 +218,8 @@ MEDIA_URL = 'media/'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
-    )
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'music_room.pagination.CursorPagination',
 }
 
 SIMPLE_JWT = {
@@ -189,6 +239,8 @@ AWS_S3_REGION_NAME = 'eu-west-3'
 AWS_S3_CUSTOM_DOMAIN = 'cdn.musicroom.tech'
 AWS_S3_ACCESS_KEY_ID = os.getenv('AWS_S3_ACCESS_KEY_ID')
 AWS_S3_SECRET_ACCESS_KEY = os.getenv('AWS_S3_SECRET_ACCESS_KEY')
+#: Opened storage files above this size spooled to disk instead of memory
+AWS_S3_MAX_MEMORY_SIZE = 5 * 1024 * 1024
 
 CSRF_TRUSTED_ORIGINS = [
     'https://musicroom.tech',
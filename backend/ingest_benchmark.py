@@ -0,0 +1,98 @@
+"""
+Peak memory of copying stored track file to local temporary file before transcoding
+
+Whole read (previous ingest) against real ingest path, ``TranscodingService.local_copy`` streaming
+object body from S3 storage by ``S3StreamBackend.chunks``. Bucket is stubbed by botocore Stubber,
+object body is read from source file, so network transfer is not measured. Every strategy runs
+at own process and reports its peak RSS::
+
+    python ingest_benchmark.py --size 200
+    python ingest_benchmark.py --source music_room/music/track.flac
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'django_app.settings')
+    import django
+    django.setup()
+
+
+def copy_whole(source: str):
+    with open(source, 'rb') as source_file, tempfile.NamedTemporaryFile() as target_file:
+        target_file.write(source_file.read())
+
+
+def copy_backend(source: str):
+    from botocore.response import StreamingBody
+    from botocore.stub import ANY, Stubber
+    from django.core.files.storage import default_storage
+    from music_room.models import Track, TrackFile
+    from music_room.services.transcoding import TranscodingService
+
+    track_file = TrackFile(id=0, file=os.path.basename(source), track=Track(name='Benchmark'))
+    client = default_storage.connection.meta.client
+    with open(source, 'rb') as body, Stubber(client) as stubber:
+        stubber.add_response(
+            'get_object',
+            {'Body': StreamingBody(body, os.path.getsize(source))},
+            {'Bucket': default_storage.bucket_name, 'Key': ANY}
+        )
+        path, temporary = TranscodingService(track_file).local_copy()
+    assert temporary and os.path.getsize(path) == os.path.getsize(source)
+    os.unlink(path)
+
+
+strategies = {
+    'whole': copy_whole,
+    'backend': copy_backend,
+}
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_strategy(strategy: str, source: str):
+    setup_django()
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    strategies[strategy](source)
+    elapsed = time.perf_counter() - started
+    print(f'{strategy:>8}: peak RSS {peak_rss_mb():8.1f} MB (interpreter {baseline:.1f} MB), {elapsed:.2f} s')
+
+
+def create_source(size_mb: int) -> str:
+    with tempfile.NamedTemporaryFile(suffix='.flac', delete=False) as source:
+        for _ in range(size_mb):
+            source.write(os.urandom(1024 * 1024))
+    return source.name
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size', type=int, default=200, help='Generated source size in MB.')
+    parser.add_argument('--source', help='Existing audio file instead of generated one.')
+    parser.add_argument('--strategy', choices=strategies.keys(), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.strategy:
+        run_strategy(args.strategy, args.source)
+        sys.exit()
+
+    source = args.source or create_source(args.size)
+    print(f'Source {os.path.getsize(source) / 1024 / 1024:.0f} MB')
+    try:
+        for name in strategies:
+            subprocess.run([sys.executable, __file__, '--strategy', name, '--source', source], check=True)
+    finally:
+        if not args.source:
+            os.unlink(source)
@@ -29,7 +29,7 @@ class FileInline(admin.StackedInline):
     model = TrackFile
     extra = 1
     max_num = 1
-    readonly_fields = ['duration', 'extension']
+    readonly_fields = ['duration', 'extension', 'loudness', 'peak_level', 'gain', 'status', 'attempts', 'error']
 
 
 @admin.register(Playlist)
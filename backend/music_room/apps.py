@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class MusicRoomConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'music_room'
+
+    def ready(self):
+        from . import services  # noqa: F401, register services signal receivers
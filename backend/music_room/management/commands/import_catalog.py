@@ -0,0 +1,182 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import reduce
+from multiprocessing import get_context
+from operator import or_
+from typing import Dict, List, Optional
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections, transaction
+from django.db.models import Q
+from tinytag import TinyTag
+
+from music_room.models import Artist, Track, TrackFile
+from music_room.services.transcoding import DatabaseQueue, TranscodingService, file_hash
+
+
+@dataclass
+class Probe:
+    path: str  #: Audio file path
+    content_hash: str  #: SHA-256 of file content
+    extension: str  #: File extension
+    artist: str  #: Artist name from tags, parent directory name if not tagged
+    title: str  #: Track name from tags, file name if not tagged
+    duration: Optional[float]  #: Duration in seconds
+
+
+def probe_file(path: str) -> Optional[Probe]:
+    """Hash and read tags of audio file, run at process pool, None if file not readable"""
+    try:
+        tags = TinyTag.get(path)
+        content_hash = file_hash(path)
+    except Exception:
+        return None
+    name, extension = os.path.splitext(os.path.basename(path))
+    return Probe(
+        path=path,
+        content_hash=content_hash,
+        extension=extension[1:].lower(),
+        artist=(tags.artist or os.path.basename(os.path.dirname(path)) or 'Unknown').strip()[:100],
+        title=(tags.title or name).strip()[:150],
+        duration=tags.duration,
+    )
+
+
+def store_file(probe: Probe) -> str:
+    """Upload file to storage under content hash name, already uploaded file reused by resumed import"""
+    name = f'music/{probe.content_hash}.{probe.extension}'
+    if not default_storage.exists(name):
+        with open(probe.path, 'rb') as file:
+            name = default_storage.save(name, File(file))
+    return name
+
+
+def transcode_pending(_=None) -> int:
+    """Process pending track files until queue empty, run at process pool, renditions encoded serially"""
+    close_old_connections()
+    queue = DatabaseQueue()
+    transcoded = 0
+    track_file_id = queue.claim()
+    while track_file_id is not None:
+        transcoded += TranscodingService.run(track_file_id, processes=1)
+        track_file_id = queue.claim()
+    connections.close_all()
+    return transcoded
+
+
+class Command(BaseCommand):
+    help = 'Import directory tree of audio files as artists, tracks and track files, already imported files skipped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Directory with audio files, searched recursively.')
+        parser.add_argument('--batch', type=int, default=500, help='Files imported per transaction.')
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='Processes for probe and transcode.')
+        parser.add_argument('--uploads', type=int, default=8, help='Parallel uploads to storage.')
+        parser.add_argument('--transcode', action='store_true', help='Transcode imported files instead of leave them to worker.')
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['directory']):
+            raise CommandError(f'{options["directory"]} is not a directory')
+        extensions = {f'.{extension}' for extension in TrackFile.Extensions.values}
+        paths = sorted(
+            os.path.join(root, name)
+            for root, _, names in os.walk(options['directory'])
+            for name in names if os.path.splitext(name)[1].lower() in extensions
+        )
+        self.stdout.write(f'Found {len(paths)} audio files')
+
+        imported, skipped, failed, conflicted = 0, 0, 0, 0
+        started = time.perf_counter()
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['processes']) as pool:
+            for offset in range(0, len(paths), options['batch']):
+                batch = paths[offset:offset + options['batch']]
+                probes = [probe for probe in pool.map(probe_file, batch, chunksize=16) if probe]
+                failed += len(batch) - len(probes)
+                probes = self.not_imported(probes)
+                skipped += len(batch) - len(probes)
+                conflicts = self.import_probes(probes, options['uploads'])
+                for probe in conflicts:
+                    self.stderr.write(f'{probe.path}: track "{probe.title}" already belongs to another artist')
+                conflicted += len(conflicts)
+                imported += len(probes) - len(conflicts)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(
+                    f'{offset + len(batch)}/{len(paths)} files: {imported} imported, {skipped} skipped, '
+                    f'{conflicted} conflicts, {failed} failed, {(offset + len(batch)) / elapsed:.1f} files/s'
+                )
+
+        if options['transcode']:
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['processes'], mp_context=get_context('fork')) as pool:
+                transcoded = sum(pool.map(transcode_pending, range(options['processes'])))
+            self.stdout.write(f'Transcoded {transcoded} track files')
+
+    @staticmethod
+    def not_imported(probes: List[Probe]) -> List[Probe]:
+        """Probes with content not imported before and not repeated at batch"""
+        imported = set(TrackFile.objects.filter(
+            content_hash__in=[probe.content_hash for probe in probes]
+        ).values_list('content_hash', flat=True))
+        unique: Dict[str, Probe] = {}
+        for probe in probes:
+            if probe.content_hash not in imported:
+                unique.setdefault(probe.content_hash, probe)
+        return list(unique.values())
+
+    @staticmethod
+    def import_probes(probes: List[Probe], uploads: int) -> List[Probe]:
+        """
+        Import probes as tracks of their artists, return conflicts not imported
+
+        Track name is unique, so probe titled as track of another artist (at database or earlier at batch)
+        is conflict, its uploaded file removed
+        """
+        if not probes:
+            return []
+        with ThreadPoolExecutor(max_workers=uploads) as pool:
+            names = list(pool.map(store_file, probes))
+
+        with transaction.atomic():
+            artist_names = {probe.artist for probe in probes}
+            artists = dict(Artist.objects.filter(name__in=artist_names).values_list('name', 'id'))
+            Artist.objects.bulk_create([Artist(name=name) for name in artist_names - artists.keys()])
+            artists = dict(Artist.objects.filter(name__in=artist_names).values_list('name', 'id'))
+
+            track_keys: Dict[str, int] = {}  # Artist id by track name, first artist of batch takes name
+            for probe in probes:
+                track_keys.setdefault(probe.title, artists[probe.artist])
+            Track.objects.bulk_create(
+                [Track(name=name, artist_id=artist_id) for name, artist_id in track_keys.items()],
+                ignore_conflicts=True
+            )
+            tracks = {
+                (artist_id, name): track_id for track_id, artist_id, name in Track.objects.filter(
+                    reduce(or_, (Q(artist_id=artist_id, name=name) for name, artist_id in track_keys.items()))
+                ).values_list('id', 'artist_id', 'name')
+            }
+
+            imported, conflicts = [], []
+            for probe, name in zip(probes, names):
+                track_id = tracks.get((artists[probe.artist], probe.title))
+                if track_id:
+                    imported.append(TrackFile(
+                        track_id=track_id,
+                        file=name,
+                        extension=probe.extension,
+                        duration=probe.duration,
+                        content_hash=probe.content_hash,
+                        status=TrackFile.Statuses.pending,
+                    ))
+                else:
+                    conflicts.append((probe, name))
+            TrackFile.objects.bulk_create(imported)
+
+        # Stored by content hash, not imported content is not referenced by any track file
+        for _, name in conflicts:
+            default_storage.delete(name)
+        return [probe for probe, _ in conflicts]
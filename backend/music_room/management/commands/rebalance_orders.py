@@ -0,0 +1,45 @@
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+
+from music_room.models import PlaylistTrack, PlayerSession
+from music_room.services.ordering import reorder
+from music_room.services.queue import QueueEngine
+
+
+def exhausted(orders):
+    return any(after - before < 2 for before, after in zip(orders, orders[1:]))
+
+
+class Command(BaseCommand):
+    help = 'Rebalance sparse order of playlist and session tracks, only lists without gaps between neighbours'
+    attempts = 3  #: Rebalance of session retried if live engine flushed it meanwhile
+
+    def add_arguments(self, parser):
+        parser.add_argument('-f', '--force', action='store_true', help='Rebalance all lists, even with gaps.')
+
+    def handle(self, *args, **options):
+        rows = PlaylistTrack.objects.order_by('playlist_id', 'order').values_list('playlist_id', 'order')
+        playlists = [
+            playlist_id for playlist_id, group in groupby(rows, key=lambda row: row[0])
+            if options['force'] or exhausted([order for _, order in group])
+        ]
+        for playlist_id in playlists:
+            reorder(PlaylistTrack.objects.filter(playlist_id=playlist_id).order_by('order').only('id', 'order'))
+
+        through = PlayerSession.track_queue.through
+        rows = through.objects.order_by('playersession_id', 'sessiontrack__order').values_list(
+            'playersession_id', 'sessiontrack__order'
+        )
+        sessions = [
+            player_session_id for player_session_id, group in groupby(rows, key=lambda row: row[0])
+            if options['force'] or exhausted([order for _, order in group])
+        ]
+        for player_session in PlayerSession.objects.filter(id__in=sessions):
+            # Through queue engine, so session version increased and live engines reload queue instead of overwrite it
+            engine = QueueEngine(player_session)
+            for _ in range(self.attempts):
+                if engine.rebalance() is not None:
+                    break
+
+        self.stdout.write(f'Rebalanced {len(playlists)} playlists and {len(sessions)} player sessions')
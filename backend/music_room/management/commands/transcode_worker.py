@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from music_room.services.transcoding import DatabaseQueue, TranscodingService
+
+
+class Command(BaseCommand):
+    help = 'Process pending track files: extract metadata and export derivatives'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when queue is empty.')
+        parser.add_argument('--poll', type=float, default=5, help='Seconds to wait for new jobs.')
+
+    def handle(self, *args, **options):
+        queue = DatabaseQueue()
+        while True:
+            close_old_connections()
+            track_file_id = queue.claim()
+            if track_file_id is None:
+                if options['once']:
+                    return
+                time.sleep(options['poll'])
+                continue
+            done = TranscodingService.run(track_file_id)
+            self.stdout.write(f'{"+" if done else "-"} Track file {track_file_id} {"processed" if done else "failed"}')
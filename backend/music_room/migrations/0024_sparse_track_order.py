@@ -0,0 +1,27 @@
+# Generated by Django 3.2.15 on 2026-10-18 12:00
+
+from django.db import migrations
+from django.db.models import F
+
+ORDER_STEP = 1024
+
+
+def spread_order(apps, schema_editor):
+    for model_name in ['PlaylistTrack', 'SessionTrack']:
+        apps.get_model('music_room', model_name).objects.update(order=F('order') * ORDER_STEP)
+
+
+def compact_order(apps, schema_editor):
+    for model_name in ['PlaylistTrack', 'SessionTrack']:
+        apps.get_model('music_room', model_name).objects.update(order=F('order') / ORDER_STEP)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_room', '0023_alter_playlist_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(spread_order, compact_order),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.15 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_room', '0024_sparse_track_order'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playersession',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.2.15 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+def mark_processed(apps, schema_editor):
+    """Existing files were transcoded synchronously on upload"""
+    TrackFile = apps.get_model('music_room', 'TrackFile')
+    TrackFile.objects.update(status='done')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_room', '0026_list_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trackfile',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='trackfile',
+            name='error',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='trackfile',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='trackfile',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='trackfile',
+            index=models.Index(fields=['status', 'updated_at'], name='track_file_status_idx'),
+        ),
+        migrations.RunPython(mark_processed, migrations.RunPython.noop),
+    ]
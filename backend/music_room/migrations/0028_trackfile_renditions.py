@@ -0,0 +1,35 @@
+# Generated by Django 3.2.15 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+import music_room.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_room', '0027_trackfile_transcoding_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trackfile',
+            name='bitrate',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='trackfile',
+            name='source',
+            field=models.ForeignKey(blank=True, default=None, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='renditions', to='music_room.trackfile'),
+        ),
+        migrations.AlterField(
+            model_name='trackfile',
+            name='extension',
+            field=models.CharField(blank=True, choices=[('mp3', 'Mp3'), ('flac', 'Flac'), ('opus', 'Opus')], max_length=50, null=True),
+        ),
+        migrations.AlterField(
+            model_name='trackfile',
+            name='file',
+            field=models.FileField(help_text='Send highest quality file, lowest will be make automatically<br>Allowed:<br> mp3<br>flac<br>opus', upload_to='music', validators=[music_room.models.audio_file_validator]),
+        ),
+    ]
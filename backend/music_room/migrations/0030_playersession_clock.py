@@ -0,0 +1,23 @@
+# Generated by Django 3.2.15 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_room', '0029_trackfile_manifest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playersession',
+            name='paused_progress',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='playersession',
+            name='started_at',
+            field=models.DateTimeField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.15 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_room', '0031_trackfile_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trackfile',
+            name='peaks',
+            field=models.FileField(blank=True, null=True, upload_to='peaks'),
+        ),
+    ]
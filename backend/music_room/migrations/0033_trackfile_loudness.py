@@ -0,0 +1,28 @@
+# Generated by Django 3.2.15 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music_room', '0032_trackfile_peaks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trackfile',
+            name='gain',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='trackfile',
+            name='loudness',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='trackfile',
+            name='peak_level',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
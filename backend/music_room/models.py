@@ -5,11 +5,9 @@ import uuid
 from io import FileIO
 from typing import List, Union
 
-from django.core.files.storage import default_storage
-from tinytag import TinyTag
-from pydub import AudioSegment
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
 from django.db import models
 from django.db.models.fields.files import FieldFile
 from django.db.models.manager import Manager
@@ -17,7 +15,9 @@ from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
 from bootstrap.utils import BootstrapMixin
-from django_app.settings import MEDIA_ROOT
+
+#: Gap between neighbour tracks order, allows to insert or move track without renumber of others
+ORDER_STEP = 1024
 
 
 class User(AbstractUser):
@@ -70,6 +70,11 @@ class Track(models.Model):
     #: Track artist
     artist: Artist = models.ForeignKey(Artist, models.CASCADE, related_name='tracks')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['artist', 'id'], name='track_artist_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -79,6 +84,13 @@ class TrackFile(models.Model):
         """Allowed extensions"""
         mp3 = 'mp3'
         flac = 'flac'
+        opus = 'opus'
+
+    class Statuses(models.TextChoices):
+        pending = 'pending', 'Pending'  #: Waiting for transcoding worker
+        processing = 'processing', 'Processing'  #: Taken by transcoding worker
+        done = 'done', 'Done'  #: Metadata extracted, derivatives exported
+        failed = 'failed', 'Failed'  #: All attempts failed, see error
 
     #: Track file
     file: Union[FileIO[bytes], FieldFile] = models.FileField(
@@ -93,53 +105,60 @@ class TrackFile(models.Model):
     duration: float = models.FloatField(blank=True, null=True)
     #: Track instance
     track: Track = models.ForeignKey(Track, models.CASCADE, related_name='files')
+    #: Rendition bitrate in kbps, empty for uploaded source file
+    bitrate: int = models.PositiveIntegerField(blank=True, null=True)
+    #: Source file this rendition exported from, empty for uploaded source file
+    source: TrackFile = models.ForeignKey(
+        'self', models.CASCADE, blank=True, null=True, default=None, related_name='renditions'
+    )
+    #: Renditions exported from this file
+    renditions: Union[TrackFile, Manager]
+    #: SHA-256 of file content, used to skip already imported files
+    content_hash: str = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+    #: HLS manifest, segments stored next to it, empty if file not segmented
+    manifest: Union[FileIO[bytes], FieldFile] = models.FileField(upload_to='hls', blank=True, null=True)
+    #: Waveform peaks, int8 min and max pairs, see :func:`music_room.services.analysis.peaks`
+    peaks: Union[FileIO[bytes], FieldFile] = models.FileField(upload_to='peaks', blank=True, null=True)
+    #: Integrated loudness in LUFS, empty if not measured or track is silent
+    loudness: float = models.FloatField(blank=True, null=True)
+    #: Sample peak in dBFS
+    peak_level: float = models.FloatField(blank=True, null=True)
+    #: Gain in dB clients apply to play track at ``PLAYER_TARGET_LOUDNESS``
+    gain: float = models.FloatField(blank=True, null=True)
+    #: Transcoding job status, see :class:`music_room.services.transcoding.TranscodingService`
+    status: Statuses = models.CharField(max_length=50, choices=Statuses.choices, default=Statuses.pending)
+    #: Transcoding attempts made
+    attempts: int = models.PositiveSmallIntegerField(default=0)
+    #: Last transcoding error
+    error: str = models.TextField(blank=True, null=True)
+    #: Last transcoding status change
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'updated_at'], name='track_file_status_idx'),
+        ]
 
     def __str__(self):
         return f'{self.track.name} - {self.extension}'
 
 
-@receiver(post_save, sender=TrackFile)
-def file_post_save(instance: TrackFile, created, *args, **kwargs):
-    post_save.disconnect(file_post_save, sender=TrackFile)
-    if instance.file:
-        file_extension = instance.file.name.split('.')[-1]
-        cloud_backend = hasattr(instance.file, 'url')
-        if cloud_backend:
-            file_path = str(MEDIA_ROOT / instance.file.name)
-            try:
-                open(file_path, 'wb').write(default_storage.open(instance.file.name).read())
-            except FileNotFoundError:
-                return
-        else:
-            file_path = instance.file.path
-        track_file_meta = TinyTag.get(file_path)
-        instance.duration = track_file_meta.duration
-        instance.extension = file_extension
-        instance.save()
-        mp3_path = file_path.replace('.flac', '.mp3')
-        mp3_name = instance.file.name.replace('.flac', '.mp3')
-        _, export_not_exist = TrackFile.objects.get_or_create(
-            id=instance.id + 1,
-            track=instance.track,
-            duration=instance.duration,
-            extension=TrackFile.Extensions.mp3,
-            file=mp3_name
-        )
-        if export_not_exist:
-            flac_audio = AudioSegment.from_file(file_path, file_extension)
-            flac_audio.export(mp3_path, format='mp3')
-        print('+', mp3_name, 'Exported')
-        if cloud_backend:
-            os.unlink(file_path)
-    post_save.connect(file_post_save, sender=TrackFile)
-
-
 @receiver(post_delete, sender=TrackFile)
 def file_post_delete(instance: TrackFile, *args, **kwargs):
     try:
         instance.file.delete()
     except FileNotFoundError:
         ...
+    if instance.peaks:
+        instance.peaks.delete(save=False)
+    if instance.manifest:
+        directory = os.path.dirname(instance.manifest.name)
+        try:
+            _, segments = default_storage.listdir(directory)
+        except FileNotFoundError:
+            segments = []
+        for segment in segments:
+            default_storage.delete(f'{directory}/{segment}')
 
 
 class Playlist(models.Model):
@@ -176,13 +195,18 @@ class Playlist(models.Model):
     #: Tracks in this playlist
     tracks: Union[PlaylistTrack, Manager]
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['access_type', 'type', 'id'], name='playlist_access_type_idx'),
+        ]
+
     def __str__(self):
         return f"{self.author}'s playlist"
 
 
 class PlaylistTrack(models.Model):
     track: Track = models.ForeignKey(Track, models.CASCADE)  #: Track object
-    order: int = models.IntegerField(default=0)  #: Track order in playlist
+    order: int = models.IntegerField(default=0)  #: Track order in playlist, sparse (see ORDER_STEP)
     playlist = models.ForeignKey(Playlist, models.CASCADE, related_name='tracks')
 
     class Meta:
@@ -218,7 +242,7 @@ class SessionTrack(models.Model):
     votes_count: int = models.PositiveIntegerField(default=0)
     #: Track time progress from duration
     progress: float = models.FloatField(default=0)
-    #: Tracks order in queue
+    #: Tracks order in queue, sparse (see ORDER_STEP)
     order: int = models.IntegerField(default=0)
 
     class Meta:
@@ -246,6 +270,12 @@ class PlayerSession(models.Model):
     mode: Modes = models.CharField(max_length=50, choices=ModeChoice, default=Modes.normal)
     #: Player Session author
     author: User = models.ForeignKey(User, models.CASCADE)
+    #: Track queue version, increased by every queue change
+    version: int = models.PositiveIntegerField(default=0)
+    #: Time current track started from beginning, empty if not playing (see PlaybackClock)
+    started_at = models.DateTimeField(blank=True, null=True, default=None)
+    #: Current track progress while paused or stopped
+    paused_progress: float = models.FloatField(default=0)
 
 
 @receiver(post_save, sender=PlayerSession)
@@ -257,7 +287,7 @@ def player_session_post_save(instance: PlayerSession, created, **kwargs):
 
     playlist_tracks: List[PlaylistTrack] = instance.playlist.tracks.all()
     for i, playlist_track in enumerate(playlist_tracks):
-        session_track = SessionTrack.objects.create(track=playlist_track.track, order=i)
+        session_track = SessionTrack.objects.create(track=playlist_track.track, order=i * ORDER_STEP)
         instance.track_queue.add(session_track)
 
 
@@ -287,6 +317,11 @@ class Event(models.Model):
 
     class Meta:
         ordering = ['start_date']
+        indexes = [
+            models.Index(fields=['start_date', 'id'], name='event_start_date_idx'),
+            models.Index(fields=['end_date'], name='event_end_date_idx'),
+            models.Index(fields=['access_type', 'start_date'], name='event_access_type_idx'),
+        ]
 
     def __str__(self):
         return self.name
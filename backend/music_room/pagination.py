@@ -0,0 +1,24 @@
+from rest_framework.pagination import CursorPagination as BaseCursorPagination
+
+
+class CursorPagination(BaseCursorPagination):
+    """
+    Keyset pagination for list endpoints, page is located by indexed ordering fields
+    instead of offset, so page latency stays constant as table grows
+
+    Opt-in by ``cursor`` or ``page_size`` query param, request without them gets plain list
+    as before, so clients decoding arrays keep working
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    ordering = 'id'  #: Unique ordering for stable pages, views override it with :attr:`pagination_ordering`
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'pagination_ordering', self.ordering)
+        return (ordering,) if isinstance(ordering, str) else tuple(ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not {self.cursor_query_param, self.page_size_query_param} & request.query_params.keys():
+            return None
+        return super(CursorPagination, self).paginate_queryset(queryset, request, view)
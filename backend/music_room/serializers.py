@@ -1,25 +1,48 @@
 import uuid
 from datetime import timedelta
+from typing import List
 
 from django.conf import settings
 from django.contrib.auth.password_validation import validate_password
+from django.db.models import QuerySet
 from django.utils import timezone
+from drf_yasg.utils import swagger_serializer_method
 from rest_framework import serializers
 from rest_framework_simplejwt.serializers import TokenRefreshSerializer as TokenRefreshBaseSerializer, \
     TokenObtainPairSerializer as TokenObtainPairBaseSerializer
 
 from .models import Track, Playlist, PlayerSession, SessionTrack, PlaylistTrack, PlaylistAccess, User, TrackFile, \
     Artist, Event
+from .services.clock import PlaybackClock
+from .services.queue import QueueEngine
+
+
+class PrefetchSerializerMixin:
+    """Declared prefetch plan of serializer, apply it to queryset before serialize many objects"""
+    select_related_fields: List[str] = []  #: Forward relations joined to queryset
+    prefetch_related_fields: List[str] = []  #: Reverse and many to many relations, include nested serializers
+
+    @classmethod
+    def prefetch(cls, queryset: QuerySet) -> QuerySet:
+        if cls.select_related_fields:
+            queryset = queryset.select_related(*cls.select_related_fields)
+        if cls.prefetch_related_fields:
+            queryset = queryset.prefetch_related(*cls.prefetch_related_fields)
+        return queryset
 
 
 class FileSerializer(serializers.ModelSerializer):
     class Meta:
         model = TrackFile
-        fields = '__all__'
+        fields = [
+            'id', 'file', 'extension', 'duration', 'track', 'bitrate', 'source', 'manifest', 'peaks',
+            'loudness', 'peak_level', 'gain', 'status',
+        ]
 
 
-class TrackSerializer(serializers.ModelSerializer):
+class TrackSerializer(PrefetchSerializerMixin, serializers.ModelSerializer):
     files = FileSerializer(many=True)
+    prefetch_related_fields = ['files']
 
     class Meta:
         model = Track
@@ -32,8 +55,9 @@ class PlaylistTrackSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
-class PlaylistSerializer(serializers.ModelSerializer):
+class PlaylistSerializer(PrefetchSerializerMixin, serializers.ModelSerializer):
     tracks = PlaylistTrackSerializer(many=True)
+    prefetch_related_fields = ['tracks']
 
     class Meta:
         model = Playlist
@@ -43,17 +67,49 @@ class PlaylistSerializer(serializers.ModelSerializer):
 class SessionTrackSerializer(serializers.ModelSerializer):
     class Meta:
         model = SessionTrack
-        fields = ['id', 'state', 'progress', 'track', 'votes_count']
+        fields = ['id', 'state', 'progress', 'track', 'votes_count', 'order']
+
+
+class PlayerSessionSerializer(PrefetchSerializerMixin, serializers.ModelSerializer):
+    track_queue = serializers.SerializerMethodField()
+    version = serializers.SerializerMethodField()
+    progress = serializers.SerializerMethodField()
+    prefetch_related_fields = ['track_queue']
 
+    @swagger_serializer_method(serializer_or_field=SessionTrackSerializer(many=True))
+    def get_track_queue(self, instance: PlayerSession):
+        return SessionTrackSerializer(QueueEngine.tracks_of(instance), many=True).data
 
-class PlayerSessionSerializer(serializers.ModelSerializer):
-    track_queue = SessionTrackSerializer(many=True)
+    @swagger_serializer_method(serializer_or_field=serializers.IntegerField())
+    def get_version(self, instance: PlayerSession):
+        engine = QueueEngine.peek(instance.id)
+        return engine.version if engine else instance.version
+
+    @swagger_serializer_method(serializer_or_field=serializers.FloatField())
+    def get_progress(self, instance: PlayerSession):
+        return PlaybackClock(instance).progress
 
     class Meta:
         model = PlayerSession
         fields = '__all__'
 
 
+class SessionTrackChangeSerializer(serializers.Serializer):
+    position = serializers.IntegerField()
+    track = SessionTrackSerializer()
+
+
+class PlayerSessionPatchSerializer(serializers.Serializer):
+    player_session_id = serializers.IntegerField()
+    version = serializers.IntegerField()
+    previous_version = serializers.IntegerField()
+    reset = serializers.BooleanField()
+    removed = serializers.ListField(child=serializers.IntegerField())
+    changes = SessionTrackChangeSerializer(many=True)
+    progress = serializers.FloatField(allow_null=True)
+    seed = serializers.IntegerField(allow_null=True)
+
+
 class PlaylistAccessSerializer(serializers.ModelSerializer):
     class Meta:
         model = PlaylistAccess
@@ -105,8 +161,9 @@ class TokenResponseSerializer(serializers.Serializer):
     access = serializers.CharField()
 
 
-class ArtistSerializer(serializers.ModelSerializer):
+class ArtistSerializer(PrefetchSerializerMixin, serializers.ModelSerializer):
     tracks = TrackSerializer(many=True)
+    prefetch_related_fields = ['tracks__files']
 
     class Meta:
         model = Artist
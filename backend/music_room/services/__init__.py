@@ -1,2 +1,4 @@
 from .player import PlayerService
 from .playlist import PlaylistService
+from .access import AccessService
+from .transcoding import TranscodingService
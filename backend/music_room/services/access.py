@@ -0,0 +1,88 @@
+from typing import Optional, Set
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from music_room.models import Playlist, PlaylistAccess, PlayerSession
+
+User = get_user_model()
+
+
+class AccessService:
+    """Users accessed to playlist and its player sessions, resolved once and cached until access changed"""
+    timeout = 60 * 60  #: Seconds to keep resolved access
+
+    @staticmethod
+    def playlist_cache_key(playlist_id: int) -> str:
+        return f'playlist-{playlist_id}-access'
+
+    @staticmethod
+    def player_session_cache_key(player_session_id: int) -> str:
+        return f'player-session-{player_session_id}-playlist'
+
+    @classmethod
+    def playlist_access(cls, playlist_id: int) -> Optional[dict]:
+        access = cache.get(cls.playlist_cache_key(playlist_id))
+        if access is None:
+            playlist = Playlist.objects.filter(id=playlist_id).values('access_type', 'author_id').first()
+            if not playlist:
+                return None
+            access = {
+                'public': playlist['access_type'] == Playlist.AccessTypes.public,
+                'users': set(
+                    PlaylistAccess.objects.filter(playlist_id=playlist_id).values_list('user_id', flat=True)
+                ) | {playlist['author_id']},
+            }
+            cache.set(cls.playlist_cache_key(playlist_id), access, cls.timeout)
+        return access
+
+    @classmethod
+    def player_session_playlist(cls, player_session_id: int) -> Optional[int]:
+        playlist_id = cache.get(cls.player_session_cache_key(player_session_id))
+        if playlist_id is None:
+            playlist_id = PlayerSession.objects.filter(id=player_session_id).values_list('playlist_id', flat=True).first()
+            if playlist_id is None:
+                return None
+            cache.set(cls.player_session_cache_key(player_session_id), playlist_id, cls.timeout)
+        return playlist_id
+
+    @classmethod
+    def accessed_users(cls, player_session_id: int) -> Optional[Set[int]]:
+        """Accessed users ids, None if session playlist is public"""
+        playlist_id = cls.player_session_playlist(player_session_id)
+        access = cls.playlist_access(playlist_id) if playlist_id is not None else None
+        if not access:
+            return set()
+        return None if access['public'] else access['users']
+
+    @classmethod
+    def is_accessed(cls, player_session_id: int, user: User) -> bool:
+        users = cls.accessed_users(player_session_id)
+        return users is None or user.id in users
+
+    @classmethod
+    def invalidate_playlist(cls, playlist_id: int):
+        cache.delete(cls.playlist_cache_key(playlist_id))
+
+    @classmethod
+    def invalidate_player_session(cls, player_session_id: int):
+        cache.delete(cls.player_session_cache_key(player_session_id))
+
+
+@receiver(post_save, sender=Playlist)
+@receiver(post_delete, sender=Playlist)
+def playlist_access_changed(instance: Playlist, **kwargs):
+    AccessService.invalidate_playlist(instance.id)
+
+
+@receiver(post_save, sender=PlaylistAccess)
+@receiver(post_delete, sender=PlaylistAccess)
+def playlist_access_user_changed(instance: PlaylistAccess, **kwargs):
+    AccessService.invalidate_playlist(instance.playlist_id)
+
+
+@receiver(post_delete, sender=PlayerSession)
+def player_session_access_deleted(instance: PlayerSession, **kwargs):
+    AccessService.invalidate_player_session(instance.id)
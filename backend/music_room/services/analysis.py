@@ -0,0 +1,120 @@
+import subprocess
+from dataclasses import dataclass
+from typing import Iterator, List, Optional
+
+import numpy as np
+from pydub.utils import get_encoder_name
+
+#: Waveform windows per track file, each stored as int8 min and max pair
+PEAKS_SIZE = 1000
+#: Sample rate of PCM peaks computed from, enough for waveform drawn at seek bar
+PEAKS_SAMPLE_RATE = 8000
+
+#: Sample rate loudness measured at, K-weighting coefficients defined for it
+LOUDNESS_SAMPLE_RATE = 48000
+#: Frames of loudness gating step (100 ms), gating block is four steps (400 ms) as ITU-R BS.1770
+LOUDNESS_STEP = LOUDNESS_SAMPLE_RATE // 10
+#: K-weighting filter stages as (numerator, denominator) coefficients, high shelf then high pass
+K_WEIGHTING = [
+    ([1.53512485958697, -2.69169618940638, 1.19839281085285], [1.0, -1.69065929318241, 0.73248077421585]),
+    ([1.0, -2.0, 1.0], [1.0, -1.99004745483398, 0.99007225036621]),
+]
+ABSOLUTE_GATE = -70  #: Blocks quieter than this LUFS ignored
+RELATIVE_GATE = -10  #: Blocks quieter than this LU below ungated loudness ignored
+
+
+def pcm_command(file_path: str, sample_rate: int, channels: int) -> List[str]:
+    return [
+        get_encoder_name(), '-loglevel', 'error', '-i', file_path, '-vn',
+        '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', str(channels), '-ar', str(sample_rate), '-'
+    ]
+
+
+def decode(file_path: str, sample_rate: int, channels: int = 1) -> np.ndarray:
+    """Decode file to 16-bit PCM by ffmpeg, samples shaped (frames, channels)"""
+    output = subprocess.run(pcm_command(file_path, sample_rate, channels), check=True, capture_output=True).stdout
+    return np.frombuffer(output, dtype=np.int16).reshape(-1, channels)
+
+
+def decode_blocks(file_path: str, sample_rate: int, channels: int, frames: int) -> Iterator[np.ndarray]:
+    """Decode file to 16-bit PCM by ffmpeg as blocks of frames, memory bounded by block size"""
+    command = pcm_command(file_path, sample_rate, channels)
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as process:
+        for data in iter(lambda: process.stdout.read(frames * channels * 2), b''):
+            yield np.frombuffer(data, dtype=np.int16).reshape(-1, channels)
+        _, error = process.communicate()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command, stderr=error)
+
+
+def peaks(samples: np.ndarray, size: int = PEAKS_SIZE) -> bytes:
+    """
+    Min and max of equal windows of mono samples as interleaved int8 pairs,
+    fewer windows if track has less samples than windows
+    """
+    samples = samples.reshape(-1)
+    if not len(samples):
+        return b''
+    starts = np.linspace(0, len(samples), min(size, len(samples)), endpoint=False).astype(np.intp)
+    minimums = np.minimum.reduceat(samples, starts) >> 8
+    maximums = np.maximum.reduceat(samples, starts) >> 8
+    return np.column_stack((minimums, maximums)).astype(np.int8).tobytes()
+
+
+def k_weighting(size: int) -> np.ndarray:
+    """Squared magnitude response of K-weighting filter at real FFT bins of size frames at 48 kHz"""
+    delay = np.exp(-2j * np.pi * np.fft.rfftfreq(size))  # z^-1 at bin frequencies, cycles per sample
+    response = np.ones_like(delay)
+    for numerator, denominator in K_WEIGHTING:
+        response *= np.polyval(numerator[::-1], delay) / np.polyval(denominator[::-1], delay)
+    return np.abs(response) ** 2
+
+
+@dataclass
+class Loudness:
+    loudness: Optional[float]  #: Integrated loudness in LUFS, None if track is silent or shorter than gating block
+    peak: Optional[float]  #: Sample peak in dBFS, None if track is silent
+
+    def gain(self, target: float) -> Optional[float]:
+        """Gain in dB to target loudness, limited so peak is not clipped"""
+        if self.loudness is None:
+            return None
+        return round(min(target - self.loudness, -self.peak), 2)
+
+
+def loudness(blocks: Iterator[np.ndarray]) -> Loudness:
+    """
+    Integrated loudness of 48 kHz PCM blocks as ITU-R BS.1770, blocks must be multiple of gating step
+
+    K-weighting applied at frequency domain: mean square of filtered step equals weighted power spectrum
+    of step (Parseval), so every step is filtered by one vectorized FFT instead of sample by sample IIR filter
+    """
+    weighting = k_weighting(LOUDNESS_STEP)
+    bins = np.full(len(weighting), 2.0)  # One sided spectrum, mirrored bins counted twice
+    bins[0] = bins[-1] = 1.0
+    weighting *= bins / LOUDNESS_STEP ** 2
+
+    energies, peak = [], 0
+    for block in blocks:
+        peak = max(peak, int(np.abs(block.astype(np.int32)).max(initial=0)))
+        steps = len(block) // LOUDNESS_STEP
+        samples = block[:steps * LOUDNESS_STEP].astype(np.float32).reshape(steps, LOUDNESS_STEP, -1) / 32768
+        power = np.abs(np.fft.rfft(samples, axis=1)) ** 2
+        energies.append(np.einsum('sfc,f->s', power, weighting))  # Channels summed with equal weight
+    energies = np.concatenate(energies) if energies else np.empty(0)
+    peak_db = float(20 * np.log10(peak / 32768)) if peak else None
+
+    if len(energies) < 4:
+        return Loudness(loudness=None, peak=peak_db)
+    cumulative = np.concatenate(([0.0], np.cumsum(energies, dtype=np.float64)))
+    gating_blocks = (cumulative[4:] - cumulative[:-4]) / 4
+    gated = gating_blocks[gating_blocks > 10 ** ((ABSOLUTE_GATE + 0.691) / 10)]
+    if not len(gated):
+        return Loudness(loudness=None, peak=peak_db)
+    gated = gated[gated > gated.mean() * 10 ** (RELATIVE_GATE / 10)]
+    return Loudness(loudness=round(float(-0.691 + 10 * np.log10(gated.mean())), 2), peak=peak_db)
+
+
+def measure_loudness(file_path: str) -> Loudness:
+    """Loudness of file decoded to stereo, mono file measured as dual mono same as it is played"""
+    return loudness(decode_blocks(file_path, LOUDNESS_SAMPLE_RATE, 2, LOUDNESS_STEP * 100))
@@ -0,0 +1,62 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from music_room.models import PlayerSession
+
+
+class PlaybackClock:
+    """
+    Current track progress kept by server: start timestamp while playing, paused offset otherwise
+
+    Progress computed on read, session written only on state transitions and rare drift corrections
+    """
+    #: Seconds of client and server progress difference ignored by sync
+    drift_tolerance = getattr(settings, 'PLAYER_DRIFT_TOLERANCE', 2)
+
+    def __init__(self, player_session: PlayerSession):
+        self.player_session = player_session
+
+    @property
+    def playing(self) -> bool:
+        return self.player_session.started_at is not None
+
+    @property
+    def progress(self) -> float:
+        if self.playing:
+            return max((timezone.now() - self.player_session.started_at).total_seconds(), 0)
+        return self.player_session.paused_progress
+
+    def save(self, started_at, paused_progress: float):
+        self.player_session.started_at = started_at
+        self.player_session.paused_progress = paused_progress
+        PlayerSession.objects.filter(id=self.player_session.id).update(
+            started_at=started_at, paused_progress=paused_progress
+        )
+
+    def start(self, progress: float = 0):
+        self.save(timezone.now() - timedelta(seconds=progress), 0)
+
+    def pause(self) -> float:
+        progress = self.progress
+        if self.playing:
+            self.save(None, progress)
+        return progress
+
+    def resume(self):
+        if not self.playing:
+            self.start(self.player_session.paused_progress)
+
+    def stop(self):
+        self.save(None, 0)
+
+    def correct(self, progress: float) -> bool:
+        """Move clock to client progress if drift exceeds tolerance, True if clock corrected"""
+        if abs(progress - self.progress) <= self.drift_tolerance:
+            return False
+        if self.playing:
+            self.start(progress)
+        else:
+            self.save(None, progress)
+        return True
@@ -0,0 +1,82 @@
+from typing import Iterable, List, Optional, Union
+
+from music_room.models import PlaylistTrack, SessionTrack, ORDER_STEP
+
+OrderedTrack = Union[PlaylistTrack, SessionTrack]
+
+
+def order_between(before: Optional[int], after: Optional[int]) -> Optional[int]:
+    """Order for track placed between two neighbours, None if gap between them exhausted"""
+    if before is None and after is None:
+        return 0
+    if before is None:
+        return after - ORDER_STEP
+    if after is None:
+        return before + ORDER_STEP
+    if after - before < 2:
+        return None
+    return (before + after) // 2
+
+
+def shuffled(items: Iterable, seed: int) -> list:
+    """
+    Fisher-Yates shuffle driven by xorshift32 generator, same seed gives same permutation on any client
+
+    For i from last index down to 1: next state (x ^= x << 13, x ^= x >> 17, x ^= x << 5, 32 bit),
+    swap item i with item state % (i + 1), zero seed replaced by 1
+    """
+    items = list(items)
+    state = seed & 0xFFFFFFFF or 1
+    for i in range(len(items) - 1, 0, -1):
+        state ^= (state << 13) & 0xFFFFFFFF
+        state ^= state >> 17
+        state ^= (state << 5) & 0xFFFFFFFF
+        j = state % (i + 1)
+        items[i], items[j] = items[j], items[i]
+    return items
+
+
+def arrange(tracks: Iterable[OrderedTrack], ids: Optional[List[int]] = None) -> List[OrderedTrack]:
+    """Arrange tracks by ids list, tracks not in list keep their relative order after listed ones"""
+    tracks = list(tracks)
+    if not ids:
+        return tracks
+    position = {track_id: i for i, track_id in enumerate(ids)}
+    return sorted(tracks, key=lambda track: position.get(track.id, len(position)))
+
+
+def renumber(tracks: Iterable[OrderedTrack], only_changed: bool = True) -> List[OrderedTrack]:
+    """Give tracks evenly spaced order by their position, return tracks which need to be saved"""
+    changed = []
+    for i, track in enumerate(tracks):
+        if track.order != i * ORDER_STEP or not only_changed:
+            track.order = i * ORDER_STEP
+            changed.append(track)
+    return changed
+
+
+def reorder(tracks: Iterable[OrderedTrack], ids: Optional[List[int]] = None, only_changed: bool = True) -> int:
+    """Renumber tracks and write new order with single bulk update, return count of updated rows"""
+    changed = renumber(arrange(tracks, ids), only_changed)
+    if changed:
+        type(changed[0]).objects.bulk_update(changed, ['order'])
+    return len(changed)
+
+
+def move(track: OrderedTrack, tracks: List[OrderedTrack], position: int) -> List[OrderedTrack]:
+    """
+    Give track order for place it at position of ordered tracks (track itself excluded from them)
+
+    Only moved track changed while gap between neighbours exists,
+    otherwise all tracks are rebalanced, return tracks which need to be saved
+    """
+    tracks = [other for other in tracks if other.id != track.id]
+    position = max(0, min(position, len(tracks)))
+    before = tracks[position - 1].order if position > 0 else None
+    after = tracks[position].order if position < len(tracks) else None
+    order = order_between(before, after)
+    if order is None:
+        tracks.insert(position, track)
+        return renumber(tracks)
+    track.order = order
+    return [track]
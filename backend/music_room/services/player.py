@@ -1,10 +1,13 @@
 import random
 from functools import wraps
-from typing import Callable
+from typing import Callable, List, Optional
 
 from django.contrib.auth import get_user_model
 
 from music_room.models import PlayerSession, SessionTrack, Track
+from .clock import PlaybackClock
+from .ordering import arrange
+from .queue import QueueEngine, QueuePatch
 
 User = get_user_model()
 
@@ -23,16 +26,6 @@ class PlayerService:
 
             return wrapper
 
-        @staticmethod
-        def lookup_session_track(f: Callable):
-            @wraps(f)
-            def wrapper(self, track, *args):
-                if isinstance(track, int):
-                    track = SessionTrack.objects.get(id=track)
-                return f(self, track, *args)
-
-            return wrapper
-
         @staticmethod
         def lookup_track(f: Callable):
             @wraps(f)
@@ -46,17 +39,11 @@ class PlayerService:
     @Decorators.lookup_player_session
     def __init__(self, player_session: [int, PlayerSession]):
         self.player_session: PlayerSession = player_session
+        self.queue: QueueEngine = QueueEngine.get(player_session) if player_session else None
+        self.clock: PlaybackClock = PlaybackClock(player_session) if player_session else None
 
-    @staticmethod
-    def vote(track: [int, SessionTrack], user: User):
-        if isinstance(track, int):
-            track = SessionTrack.objects.get(id=track)
-        track.votes.remove(user) if user in track.votes.all() else track.votes.add(user)
-        track.votes_count = track.votes.all().count()
-        # If only one vote, is not affect the queue
-        if track.votes_count == 1:
-            track.votes_count = 0
-        track.save()
+    def vote(self, track: [int, SessionTrack], user: User) -> SessionTrack:
+        return self.queue.vote(track, user)
 
     def play_next(self) -> SessionTrack:
         if self.player_session.mode == self.player_session.Modes.repeat:
@@ -68,121 +55,87 @@ class PlayerService:
             return self.play_track(self.current_track)
         return self.play_track(self.previous_track)
 
-    def reset_tracks_progress(self):
-        for track in self.player_session.track_queue.filter(progress__gt=0).all():
-            track: SessionTrack
-            track.progress = 0
-            track.save()
-
-    def reset_tracks_votes(self):
-        for track in self.player_session.track_queue.all():
-            track: SessionTrack
-            track.votes.clear()
-            track.votes_count = 0
-            track.save()
-
-    @Decorators.lookup_session_track
     def play_track(self, track: [int, SessionTrack]) -> SessionTrack:
-        first_track = self.current_track
-        next_track = track
-        last_track = self.previous_track
-
-        reverse = next_track == last_track
-
-        next_track.order = -1
-        if not reverse:
-            first_track.order = self.player_session.track_queue.all().count()
-
-        first_track.state = SessionTrack.States.stopped
-        next_track.state = SessionTrack.States.playing
-        next_track.save()
-        first_track.save()
-        last_track.save()
-        track.save()
-
-        self.reset_tracks_progress()
-        self.reset_tracks_votes()
-        self.resort()
+        track = self.queue.play(track)
+        if track:
+            self.clock.start()
         return track
 
-    @Decorators.lookup_session_track
     def delay_play_track(self, track: [int, SessionTrack]) -> SessionTrack:
-        self.current_track.order = -1
-        track.order = 0
-        self.current_track.save()
-        track.save()
-
-        self.resort()
-        return track
+        return self.queue.delay(track)
 
     @property
     def previous_track(self) -> SessionTrack:
-        return self.player_session.track_queue.last()
+        return self.queue.previous
 
     @property
     def current_track(self) -> SessionTrack:
-        return self.player_session.track_queue.first()
+        return self.queue.current
 
     @property
     def next_track(self) -> SessionTrack:
-        if self.player_session.track_queue.all().count() >= 2:
-            return self.player_session.track_queue.all()[1]
-        else:
-            return self.current_track
-
-    def shuffle(self):
-        if self.current_track:
-            tracks = list(self.player_session.playlist.tracks.exclude(track=self.current_track.track).all())
-            self.player_session.track_queue.exclude(order=self.current_track.order).all().delete()
-        else:
-            tracks = list(self.player_session.playlist.tracks.all())
-        for i in range(len(tracks)):
-            random_track = random.choice(tracks)
-            session_track = SessionTrack.objects.create(
-                track=tracks.pop(tracks.index(random_track)).track,
-                order=i + 1
-            )
-            self.player_session.track_queue.add(session_track)
+        return self.queue.next
+
+    def shuffle(self, seed: Optional[int] = None) -> int:
+        """Shuffle queue except current track, reproducible by seed (random if not provided), return seed"""
+        seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.queue.shuffle(seed)
+        return seed
+
+    @property
+    def progress(self) -> float:
+        """Current track progress by session clock"""
+        return self.clock.progress
 
     def pause_track(self):
-        track: SessionTrack = self.current_track
-        track.state = SessionTrack.States.paused
-        track.save()
+        self.queue.sync(self.clock.pause())
+        self.queue.set_state(self.current_track, SessionTrack.States.paused)
 
     def resume_track(self):
-        track: SessionTrack = self.current_track
-        track.state = SessionTrack.States.playing
-        track.save()
+        self.clock.resume()
+        self.queue.set_state(self.current_track, SessionTrack.States.playing)
 
     def stop_track(self):
-        track: SessionTrack = self.current_track
-        track.state = SessionTrack.States.stopped
-        track.save()
+        self.clock.stop()
+        self.queue.sync(0)
+        self.queue.set_state(self.current_track, SessionTrack.States.stopped)
 
     def freeze_session(self):
-        track: SessionTrack = self.player_session.track_queue.filter(state=SessionTrack.States.playing).first()
-        if track:
-            track.state = SessionTrack.States.paused
-            track.save()
-
-    def sync_track(self, progress: float):
-        track: SessionTrack = self.current_track
-        track.progress = progress
-        track.save()
-
-    def resort(self):
-        for i, track in enumerate(self.player_session.track_queue.all()):
-            track.order = i
-            track.save()
+        if self.queue.playing:
+            self.queue.sync(self.clock.pause())
+        self.queue.set_state(self.queue.playing, SessionTrack.States.paused)
+        self.queue.flush()
+
+    def sync_track(self, progress: float) -> bool:
+        """Correct session clock by client progress, only drift above tolerance is written"""
+        return self.clock.correct(progress)
+
+    def resort(self, tracks: List[int] = None, only_changed: bool = True) -> int:
+        """
+        Renumber session tracks, changed tracks are written with one bulk update on flush
+
+        :param tracks: Session track ids in new order, current order if not provided
+        :param only_changed: Skip tracks which order not changed
+        """
+        return self.queue.renumber(arrange(self.queue.tracks, tracks), only_changed)
+
+    def flush(self):
+        self.queue.flush()
+
+    def locked(self):
+        """Context of one action: queue mutations and commit not interleaved with other workers"""
+        return self.queue.locked()
+
+    def commit(self) -> Optional[QueuePatch]:
+        """Increase session version and get queue changes since previous commit"""
+        patch = self.queue.commit()
+        if patch:
+            patch.progress = self.clock.progress
+        return patch
 
     @Decorators.lookup_track
     def add_track(self, track: [int, Track]):
-        session_track = SessionTrack.objects.create(
-            track=track,
-            order=self.player_session.track_queue.all().count()
-        )
-        self.player_session.track_queue.add(session_track)
+        self.queue.add(self.player_session, track)
 
-    @Decorators.lookup_session_track
     def remove_track(self, track: [int, SessionTrack]):
-        self.player_session.track_queue.remove(track)
+        self.queue.remove(self.player_session, track)
@@ -1,8 +1,10 @@
-from typing import Callable
+from typing import Callable, List
 
 from django.contrib.auth import get_user_model
+from django.db.models import Max
 
-from music_room.models import Track, Playlist
+from music_room.models import Track, Playlist, PlaylistTrack
+from .ordering import reorder, order_between, move
 
 User = get_user_model()
 
@@ -48,13 +50,23 @@ class PlaylistService:
 
     @Decorators.lookup_track
     def add_track(self, track: [int, Track]):
-        self.playlist.tracks.create(track=track, order=self.playlist.tracks.all().count() + 1)
-        self.resort()
+        last_order = self.playlist.tracks.aggregate(last_order=Max('order'))['last_order']
+        self.playlist.tracks.create(track=track, order=order_between(last_order, None))
 
     @Decorators.lookup_track
     def remove_track(self, track: [int, Track]):
         self.playlist.tracks.filter(track=track).delete()
-        self.resort()
+
+    @Decorators.lookup_track
+    def move_track(self, track: [int, Track], position: int) -> int:
+        """Move track to position, neighbours untouched while gap between them exists, return count of saved rows"""
+        tracks = list(PlaylistTrack.objects.filter(playlist=self.playlist).only('id', 'order', 'track_id'))
+        playlist_track = next((playlist_track for playlist_track in tracks if playlist_track.track_id == track.id), None)
+        if not playlist_track:
+            return 0
+        changed = move(playlist_track, tracks, position)
+        PlaylistTrack.objects.bulk_update(changed, ['order'])
+        return len(changed)
 
     def change(self, name: str = None, access_type: [str, Playlist.AccessTypes] = None):
         if not name:
@@ -77,7 +89,11 @@ class PlaylistService:
         self.playlist.access_type = access_type
         self.playlist.save()
 
-    def resort(self):
-        for i, track in enumerate(self.playlist.tracks.all()):
-            track.order = i
-            track.save()
+    def resort(self, tracks: List[int] = None, only_changed: bool = True) -> int:
+        """
+        Renumber playlist tracks with one bulk update
+
+        :param tracks: Playlist track ids in new order, current order if not provided
+        :param only_changed: Skip tracks which order not changed
+        """
+        return reorder(PlaylistTrack.objects.filter(playlist=self.playlist).only('id', 'order'), tracks, only_changed)
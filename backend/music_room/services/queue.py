@@ -0,0 +1,521 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from music_room.models import PlayerSession, SessionTrack, Track
+from .ordering import renumber, order_between, move, shuffled
+from .track_queue import TrackQueue
+
+User = get_user_model()
+
+
+@dataclass
+class QueuePatch:
+    """Queue changes between two versions, apply: drop removed and changed tracks, insert changed by position"""
+
+    @dataclass
+    class Change:
+        position: int  #: Track position in queue after patch
+        track: SessionTrack  #: Changed track
+
+    player_session_id: int  #: Player session id
+    version: int  #: Queue version after patch
+    previous_version: int  #: Queue version patch based on
+    reset: bool = False  #: Queue rebuilt, changes contain whole queue
+    removed: List[int] = field(default_factory=list)  #: Removed session track ids
+    changes: List[Change] = field(default_factory=list)  #: Added or changed tracks ordered by position
+    progress: Optional[float] = None  #: Current track progress by session clock
+    #: Shuffle seed, apply before changes: tracks except queue head ordered by order get own orders permuted
+    #: by :func:`music_room.services.ordering.shuffled`, shuffled tracks not repeated in changes
+    seed: Optional[int] = None
+
+
+class QueueEngine:
+    """
+    Authoritative track queue of live player session, kept in process memory
+
+    Queue ordered by :class:`TrackQueue` (votes count, then order),
+    mutations repositioning only changed tracks, changed rows flushed to database in one batch after :attr:`flush_interval` or by :meth:`flush`
+
+    With :attr:`shared` queue (several workers) changes flushed on every commit
+    and other workers reload queue when their version is behind shared one,
+    actions of workers on same session serialized by :meth:`locked`.
+    Session version written by compare and set, so writer behind database reloads queue instead of overwrite it
+
+    Engine kept while consumers of session connected (:meth:`attach`, :meth:`detach`),
+    engine of session without consumers dropped after :attr:`idle_timeout`
+    """
+    flush_interval: float = 2  #: Seconds to wait before write-behind flush of changed tracks
+    shared: bool = getattr(settings, 'PLAYER_QUEUE_SHARED', False)  #: Queue shared between workers by cache
+    flush_fields = ['order', 'state', 'progress', 'votes_count']  #: Session track fields kept in memory
+    lock_timeout: float = 10  #: Seconds shared session lock kept by crashed worker and waited by others
+    commit_attempts: int = 3  #: Commits of shared queue retried after version conflict
+
+    idle_timeout: float = 600  #: Seconds engine of session without connected consumers kept after last use
+
+    engines: Dict[int, 'QueueEngine'] = {}  #: Live engines by player session id
+    engines_lock = threading.Lock()
+    consumers: Dict[int, int] = {}  #: Connected consumers count by player session id
+    evicted_at: float = 0  #: Last idle engines eviction
+
+    @classmethod
+    def get(cls, player_session: PlayerSession) -> 'QueueEngine':
+        with cls.engines_lock:
+            engine = cls.engines.get(player_session.id)
+            if not engine:
+                engine = cls(player_session)
+                cls.engines[player_session.id] = engine
+            engine.used_at = time.monotonic()
+        engine.refresh(player_session)
+        cls.evict_idle()
+        return engine
+
+    @classmethod
+    def attach(cls, player_session_id: int):
+        """Count consumer connected to session, its engine kept while any consumer connected"""
+        with cls.engines_lock:
+            cls.consumers[player_session_id] = cls.consumers.get(player_session_id, 0) + 1
+
+    @classmethod
+    def detach(cls, player_session_id: int):
+        """Uncount disconnected consumer, engine flushed and dropped when last consumer of session disconnected"""
+        with cls.engines_lock:
+            count = cls.consumers.pop(player_session_id, 0) - 1
+            if count > 0:
+                cls.consumers[player_session_id] = count
+                return
+        cls.drop(player_session_id)
+
+    @classmethod
+    def evict_idle(cls):
+        """
+        Drop engines of sessions without connected consumers not used for :attr:`idle_timeout`,
+        e.g. session changed by consumer connected to another session, checked at most once per timeout
+        """
+        now = time.monotonic()
+        with cls.engines_lock:
+            if now - cls.evicted_at < cls.idle_timeout:
+                return
+            cls.evicted_at = now
+            idle = [
+                player_session_id for player_session_id, engine in cls.engines.items()
+                if player_session_id not in cls.consumers and now - engine.used_at > cls.idle_timeout
+            ]
+        for player_session_id in idle:
+            cls.drop(player_session_id)
+
+    @classmethod
+    def peek(cls, player_session_id: int) -> Optional['QueueEngine']:
+        return cls.engines.get(player_session_id)
+
+    @classmethod
+    def drop(cls, player_session_id: int):
+        with cls.engines_lock:
+            engine = cls.engines.pop(player_session_id, None)
+        if engine:
+            engine.flush()
+
+    @classmethod
+    def tracks_of(cls, player_session: PlayerSession) -> List[SessionTrack]:
+        """Ordered session tracks, from live engine if session already loaded"""
+        engine = cls.peek(player_session.id)
+        if engine:
+            return engine.tracks
+        return list(player_session.track_queue.all())
+
+    def __init__(self, player_session: PlayerSession):
+        self.player_session_id = player_session.id
+        self.lock = threading.RLock()
+        self.queue = TrackQueue()  #: Vote ordered session tracks
+        self.votes: Dict[int, int] = {}  #: Real votes count by session track id
+        self.progressed: Set[int] = set()  #: Session track ids with not null progress
+        self.dirty: Dict[int, SessionTrack] = {}
+        self.timer: Optional[threading.Timer] = None
+        self.version: int = player_session.version  #: Queue version, increased by every committed patch
+        self.flushed_version: int = player_session.version
+        self.changed: Set[int] = set()  #: Session track ids changed since last patch
+        self.removed: Set[int] = set()  #: Session track ids removed since last patch
+        self.seed: Optional[int] = None  #: Seed of shuffle since last patch
+        self.used_at: float = time.monotonic()  #: Last time engine taken by :meth:`get`
+        self.load(player_session)
+        self.reloaded = False
+
+    def load(self, player_session: PlayerSession):
+        with self.lock:
+            self.queue, self.progressed = TrackQueue(), set()
+            self.reloaded = True
+            tracks = list(player_session.track_queue.all())
+            self.votes = dict(
+                SessionTrack.votes.through.objects.filter(
+                    sessiontrack_id__in=[track.id for track in tracks]
+                ).values('sessiontrack_id').annotate(count=Count('id')).values_list('sessiontrack_id', 'count')
+            )
+            for track in tracks:
+                self.insert(track)
+
+    @property
+    def version_cache_key(self) -> str:
+        return f'player-session-{self.player_session_id}-version'
+
+    @property
+    def lock_cache_key(self) -> str:
+        return f'player-session-{self.player_session_id}-lock'
+
+    def refresh(self, player_session: PlayerSession):
+        """
+        Reload queue if it was changed by another worker,
+        not shared queue reloaded if session version written by another process (e.g. ``rebalance_orders``)
+        """
+        if not self.shared:
+            with self.lock:
+                if player_session.version > self.flushed_version and self.flush():
+                    self.reload()
+            return
+        version = cache.get(self.version_cache_key)
+        with self.lock:
+            if version is None or version == self.version:
+                return
+            if self.flush():
+                self.load(player_session)
+                self.version = self.flushed_version = version
+            self.changed, self.removed, self.reloaded, self.seed = set(), set(), False, None
+
+    def reload(self):
+        """Rebuild queue from database after session changed by another writer, next commit sends whole queue"""
+        player_session = PlayerSession.objects.filter(id=self.player_session_id).first()
+        if not player_session:
+            return
+        self.load(player_session)
+        self.version = self.flushed_version = player_session.version
+        self.changed, self.removed, self.seed = set(), set(), None
+
+    @contextmanager
+    def locked(self):
+        """
+        Hold queue for one action from mutation to commit,
+        shared queue also locked for other workers by cache and refreshed after lock taken
+        """
+        with self.lock:
+            if not self.shared:
+                yield self
+                return
+            token = uuid.uuid4().hex
+            deadline = time.monotonic() + self.lock_timeout
+            while not cache.add(self.lock_cache_key, token, self.lock_timeout):
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f'Player session {self.player_session_id} is locked')
+                time.sleep(0.01)
+            try:
+                player_session = PlayerSession.objects.filter(id=self.player_session_id).first()
+                if player_session:
+                    self.refresh(player_session)
+                yield self
+            finally:
+                if cache.get(self.lock_cache_key) == token:
+                    cache.delete(self.lock_cache_key)
+
+    def insert(self, track: SessionTrack):
+        self.queue.insert(track)
+        if track.progress:
+            self.progressed.add(track.id)
+
+    def discard(self, track: SessionTrack):
+        self.queue.discard(track)
+        self.progressed.discard(track.id)
+
+    def update(self, track: SessionTrack, **fields):
+        """Change track fields, reposition it at queue and mark for flush"""
+        self.queue.reposition(track, **fields)
+        if track.progress:
+            self.progressed.add(track.id)
+        else:
+            self.progressed.discard(track.id)
+        self.mark_dirty(track)
+        self.changed.add(track.id)
+
+    def mark_dirty(self, *tracks: SessionTrack):
+        for track in tracks:
+            self.dirty[track.id] = track
+        if (self.dirty or self.version != self.flushed_version) and not self.timer:
+            self.timer = threading.Timer(self.flush_interval, self.flush_by_timer)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self) -> bool:
+        """
+        Write changed tracks and version if session version is still flushed one (compare and set),
+        False if session was changed by another writer meanwhile, queue reloaded from database then
+        """
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            if not self.dirty and self.version == self.flushed_version:
+                return True
+            dirty, self.dirty = list(self.dirty.values()), {}
+            with transaction.atomic():
+                written = PlayerSession.objects.filter(
+                    id=self.player_session_id, version=self.flushed_version
+                ).update(version=self.version)
+                if written and dirty:
+                    SessionTrack.objects.bulk_update(dirty, self.flush_fields)
+            if not written:
+                self.reload()
+                return False
+            self.flushed_version = self.version
+            return True
+
+    def commit(self) -> Optional[QueuePatch]:
+        """
+        Increase queue version and collect changes since previous commit, None if nothing changed
+
+        Shared queue flushed at once, if another worker changed session meanwhile
+        queue is reloaded and whole queue committed instead
+        """
+        with self.lock:
+            for _ in range(self.commit_attempts if self.shared else 1):
+                patch = self.collect()
+                if not patch or not self.shared:
+                    break
+                if self.flush():
+                    cache.set(self.version_cache_key, self.version, None)
+                    break
+            else:
+                return
+            if patch and not self.shared:
+                self.mark_dirty()
+            return patch
+
+    def collect(self) -> Optional[QueuePatch]:
+        with self.lock:
+            if not self.changed and not self.removed and not self.reloaded and self.seed is None:
+                return
+            patch = QueuePatch(
+                player_session_id=self.player_session_id,
+                version=self.version + 1,
+                previous_version=self.version,
+                reset=self.reloaded,
+                removed=[] if self.reloaded else sorted(self.removed),
+                seed=None if self.reloaded else self.seed,
+            )
+            changed = self.queue.ids() if self.reloaded else self.changed & self.queue.ids()
+            patch.changes = sorted(
+                [QueuePatch.Change(position=self.position(track_id), track=self.track(track_id)) for track_id in changed],
+                key=lambda change: change.position
+            )
+            self.version = patch.version
+            self.changed, self.removed, self.reloaded, self.seed = set(), set(), False, None
+            return patch
+
+    def position(self, track_id: int) -> int:
+        return self.queue.position(track_id)
+
+    def flush_by_timer(self):
+        try:
+            self.flush()
+        finally:
+            connection.close()
+
+    @property
+    def tracks(self) -> List[SessionTrack]:
+        with self.lock:
+            return list(self.queue)
+
+    def track(self, track: [int, SessionTrack]) -> Optional[SessionTrack]:
+        return self.queue.track(track if isinstance(track, int) else track.id)
+
+    @property
+    def current(self) -> Optional[SessionTrack]:
+        return self.queue.current
+
+    @property
+    def next(self) -> Optional[SessionTrack]:
+        return self.queue.next
+
+    @property
+    def previous(self) -> Optional[SessionTrack]:
+        return self.queue.previous
+
+    @property
+    def orders(self) -> List[int]:
+        return self.queue.orders
+
+    @property
+    def first_order(self) -> int:
+        return min(self.orders, default=0)
+
+    @property
+    def last_order(self) -> int:
+        return max(self.orders, default=0)
+
+    def reset(self):
+        """
+        Reset votes and progress of all tracks
+
+        Written immediately: one delete of session votes and one update of not zero tracks,
+        skipped if queue has no votes and progress
+        """
+        voted = [track_id for track_id, count in self.votes.items() if count]
+        if voted:
+            SessionTrack.votes.through.objects.filter(sessiontrack__playersession=self.player_session_id).delete()
+        if voted or self.progressed:
+            SessionTrack.objects.filter(
+                Q(votes_count__gt=0) | ~Q(progress=0), playersession=self.player_session_id
+            ).update(votes_count=0, progress=0)
+        for track_id in set(voted) | self.progressed:
+            track = self.track(track_id)
+            if track and (track.votes_count or track.progress):
+                self.queue.reposition(track, votes_count=0, progress=0)
+                self.changed.add(track.id)
+        self.votes, self.progressed = {}, set()
+
+    def play(self, track: [int, SessionTrack]) -> Optional[SessionTrack]:
+        with self.lock:
+            track = self.track(track)
+            first_track = self.current
+            last_track = self.previous
+            if not track or not first_track:
+                return track
+
+            self.reset()
+            if track is not first_track:
+                if track is not last_track:
+                    self.update(first_track, order=order_between(self.last_order, None))
+                self.update(track, order=order_between(None, self.first_order))
+                self.update(first_track, state=SessionTrack.States.stopped)
+            self.update(track, state=SessionTrack.States.playing)
+            return track
+
+    def delay(self, track: [int, SessionTrack]) -> Optional[SessionTrack]:
+        """Move track right after current track"""
+        with self.lock:
+            track = self.track(track)
+            current = self.current
+            if not track or track is current:
+                return track
+            by_order = sorted(self.tracks, key=lambda other: (other.order, other.id))
+            self.move(current, by_order, 0)
+            by_order.remove(current)
+            self.move(track, [current] + by_order, 1)
+            return track
+
+    def shuffle(self, seed: int):
+        """Permute orders of all tracks except queue head by seeded shuffle, rows kept, changed orders flushed"""
+        with self.lock:
+            current = self.current
+            tracks = sorted(
+                (track for track in self.queue if track is not current), key=lambda track: (track.order, track.id)
+            )
+            orders = [track.order for track in tracks]
+            for track, order in zip(shuffled(tracks, seed), orders):
+                if track.order != order:
+                    self.queue.reposition(track, order=order)
+                    self.mark_dirty(track)
+            self.seed = seed
+
+    def rebalance(self) -> Optional[int]:
+        """
+        Give all tracks evenly spaced order keeping queue, committed and flushed at once,
+        return count of changed tracks, None if session was changed meanwhile and queue reloaded
+        """
+        with self.locked():
+            changed = self.renumber(sorted(self.tracks, key=lambda track: (track.order, track.id)))
+            self.commit()
+            return changed if self.flush() else None
+
+    def move(self, track: SessionTrack, tracks: List[SessionTrack], position: int):
+        """Place track at position of tracks ordered by order, only moved track changed while gaps exist"""
+        with self.lock:
+            for changed in move(track, tracks, position):
+                self.update(changed)
+
+    def renumber(self, tracks: List[SessionTrack], only_changed: bool = True) -> int:
+        """Give tracks evenly spaced order by list position and mark them for flush"""
+        with self.lock:
+            changed = renumber(tracks, only_changed)
+            for track in changed:
+                self.update(track)
+            return len(changed)
+
+    def vote(self, track: [int, SessionTrack], user: User) -> Optional[SessionTrack]:
+        with self.lock:
+            track = self.track(track)
+            if not track:
+                return
+            votes_count = self.toggle_vote(track.id, user.id)
+            self.votes[track.id] = votes_count
+            # If only one vote, is not affect the queue
+            self.update(track, votes_count=votes_count if votes_count > 1 else 0)
+            return track
+
+    @staticmethod
+    def toggle_vote(track_id: int, user_id: int) -> int:
+        """
+        Add or remove user vote and store votes count in one transaction, return real votes count
+
+        Session track row is locked by update before anything is read, so concurrent voters of same track
+        are serialized (row lock, or write lock of whole database at SQLite), unique vote per user is kept
+        by votes table constraint
+        """
+        through = SessionTrack.votes.through
+        with transaction.atomic():
+            SessionTrack.objects.filter(id=track_id).update(votes_count=F('votes_count'))
+            deleted, _ = through.objects.filter(sessiontrack_id=track_id, user_id=user_id).delete()
+            if not deleted:
+                through.objects.bulk_create([through(sessiontrack_id=track_id, user_id=user_id)], ignore_conflicts=True)
+            votes_count = through.objects.filter(sessiontrack_id=track_id).count()
+            # If only one vote, is not affect the queue
+            SessionTrack.objects.filter(id=track_id).update(votes_count=votes_count if votes_count > 1 else 0)
+        return votes_count
+
+    def set_state(self, track: Optional[SessionTrack], state: SessionTrack.States):
+        with self.lock:
+            if track:
+                self.update(track, state=state)
+
+    @property
+    def playing(self) -> Optional[SessionTrack]:
+        with self.lock:
+            return next((track for track in self.tracks if track.state == SessionTrack.States.playing), None)
+
+    def sync(self, progress: float):
+        with self.lock:
+            track = self.current
+            if track:
+                self.update(track, progress=progress)
+
+    def add(self, player_session: PlayerSession, track: Track) -> SessionTrack:
+        with self.lock:
+            session_track = SessionTrack.objects.create(track=track, order=order_between(self.last_order, None))
+            player_session.track_queue.add(session_track)
+            self.insert(session_track)
+            self.changed.add(session_track.id)
+            return session_track
+
+    def remove(self, player_session: PlayerSession, track: [int, SessionTrack]):
+        with self.lock:
+            track = self.track(track)
+            if not track:
+                return
+            player_session.track_queue.remove(track)
+            self.discard(track)
+            self.votes.pop(track.id, None)
+            self.dirty.pop(track.id, None)
+            self.changed.discard(track.id)
+            self.removed.add(track.id)
+
+
+@receiver(post_delete, sender=PlayerSession)
+def player_session_post_delete(instance: PlayerSession, **kwargs):
+    QueueEngine.drop(instance.id)
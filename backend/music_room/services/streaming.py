@@ -0,0 +1,137 @@
+import mimetypes
+import mmap
+import os
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Iterator, Optional, Tuple
+
+from django.core.files.storage import default_storage
+from storages.utils import clean_name
+
+from music_room.models import TrackFile
+
+#: Bytes read per chunk of streamed response
+CHUNK_SIZE = 64 * 1024
+
+mimetypes.add_type('audio/flac', '.flac')
+mimetypes.add_type('audio/ogg', '.opus')
+
+
+@dataclass
+class FileStat:
+    size: int  #: File size in bytes
+    modified: datetime  #: Last modification time
+    etag: str  #: Entity tag, quoted
+
+    @property
+    def modified_timestamp(self) -> int:
+        return int(self.modified.timestamp())
+
+
+class StreamBackend:
+    """Read byte ranges of stored track file without load whole file"""
+
+    def __init__(self, track_file: TrackFile):
+        self.track_file = track_file
+        self.name = track_file.file.name
+
+    @property
+    def content_type(self) -> str:
+        return mimetypes.guess_type(self.name)[0] or 'application/octet-stream'
+
+    def stat(self) -> FileStat:
+        ...
+
+    def read(self, start: int, end: int) -> Iterator[bytes]:
+        """Yield bytes from start to end inclusive"""
+        ...
+
+    def chunks(self) -> Iterator[bytes]:
+        """Yield whole file by fixed size chunks, memory bounded by chunk size"""
+        ...
+
+
+class LocalStreamBackend(StreamBackend):
+    """File at local storage, ranges read from memory mapped file"""
+
+    @property
+    def path(self) -> str:
+        return default_storage.path(self.name)
+
+    def stat(self) -> FileStat:
+        stat = os.stat(self.path)
+        return FileStat(
+            size=stat.st_size,
+            modified=datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+            etag=f'"{self.track_file.id}-{stat.st_size}-{int(stat.st_mtime)}"'
+        )
+
+    def open(self):
+        """File object for whole file response, served by server file wrapper (sendfile) if available"""
+        return open(self.path, 'rb')
+
+    def read(self, start: int, end: int) -> Iterator[bytes]:
+        with open(self.path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for offset in range(start, end + 1, CHUNK_SIZE):
+                yield mapped[offset:min(offset + CHUNK_SIZE, end + 1)]
+
+    def chunks(self) -> Iterator[bytes]:
+        with open(self.path, 'rb') as file:
+            yield from iter(lambda: file.read(CHUNK_SIZE), b'')
+
+
+class S3StreamBackend(StreamBackend):
+    """File at S3 storage, ranges requested from bucket by Range header"""
+
+    @property
+    def client(self):
+        return default_storage.connection.meta.client
+
+    @property
+    def key(self) -> str:
+        return default_storage._normalize_name(clean_name(self.name))
+
+    def stat(self) -> FileStat:
+        head = self.client.head_object(Bucket=default_storage.bucket_name, Key=self.key)
+        return FileStat(size=head['ContentLength'], modified=head['LastModified'], etag=head['ETag'])
+
+    def read(self, start: int, end: int) -> Iterator[bytes]:
+        response = self.client.get_object(Bucket=default_storage.bucket_name, Key=self.key, Range=f'bytes={start}-{end}')
+        yield from response['Body'].iter_chunks(CHUNK_SIZE)
+
+    def chunks(self) -> Iterator[bytes]:
+        """Object body streamed from bucket, unlike storage file which buffers whole object"""
+        response = self.client.get_object(Bucket=default_storage.bucket_name, Key=self.key)
+        yield from response['Body'].iter_chunks(CHUNK_SIZE)
+
+
+def stream_backend(track_file: TrackFile) -> StreamBackend:
+    """Backend by storage, local if storage has file paths"""
+    try:
+        default_storage.path(track_file.file.name)
+        return LocalStreamBackend(track_file)
+    except NotImplementedError:
+        return S3StreamBackend(track_file)
+
+
+def parse_range(header: Optional[str], size: int) -> Tuple[Optional[Tuple[int, int]], bool]:
+    """
+    Single byte range from Range header as (start, end) inclusive,
+    second value is False if range not satisfiable, multiple or malformed ranges ignored
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None, True
+    start, _, end = header[len('bytes='):].strip().partition('-')
+    try:
+        if not start:
+            suffix = int(end)
+            if suffix <= 0:
+                return None, False
+            return (max(size - suffix, 0), size - 1), size > 0
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    except ValueError:
+        return None, True
+    if start > end or start >= size:
+        return None, False
+    return (start, end), True
@@ -0,0 +1,85 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sortedcontainers import SortedList
+
+from music_room.models import SessionTrack
+
+SortKey = Tuple[int, int, int]
+
+
+class TrackQueue:
+    """
+    Session tracks ordered by votes count, then order (same as :class:`music_room.models.SessionTrack`)
+
+    Current, next and previous tracks answered in O(1),
+    insert, remove and reposition of track after vote or move in O(log n)
+    """
+
+    def __init__(self, tracks: List[SessionTrack] = None):
+        self.keys: SortedList = SortedList()  #: Sorted queue keys
+        self.by_key: Dict[SortKey, SessionTrack] = {}
+        self.key_of: Dict[int, SortKey] = {}
+        for track in tracks or []:
+            self.insert(track)
+
+    @staticmethod
+    def sort_key(track: SessionTrack) -> SortKey:
+        return -track.votes_count, track.order, track.id
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __iter__(self) -> Iterator[SessionTrack]:
+        return (self.by_key[key] for key in self.keys)
+
+    def __contains__(self, track_id: int) -> bool:
+        return track_id in self.key_of
+
+    def ids(self):
+        return self.key_of.keys()
+
+    def insert(self, track: SessionTrack):
+        key = self.sort_key(track)
+        self.keys.add(key)
+        self.by_key[key] = track
+        self.key_of[track.id] = key
+
+    def discard(self, track: SessionTrack):
+        key = self.key_of.pop(track.id)
+        self.keys.remove(key)
+        del self.by_key[key]
+
+    def reposition(self, track: SessionTrack, **fields):
+        """Change track fields affecting order and move it to new place"""
+        self.discard(track)
+        for field, value in fields.items():
+            setattr(track, field, value)
+        self.insert(track)
+
+    def position(self, track_id: int) -> int:
+        return self.keys.index(self.key_of[track_id])
+
+    def track(self, track_id: int) -> Optional[SessionTrack]:
+        key = self.key_of.get(track_id)
+        return self.by_key[key] if key else None
+
+    @property
+    def current(self) -> Optional[SessionTrack]:
+        return self.by_key[self.keys[0]] if self.keys else None
+
+    @property
+    def next(self) -> Optional[SessionTrack]:
+        return self.by_key[self.keys[1]] if len(self.keys) >= 2 else self.current
+
+    @property
+    def previous(self) -> Optional[SessionTrack]:
+        return self.by_key[self.keys[-1]] if self.keys else None
+
+    @property
+    def orders(self) -> List[int]:
+        """Orders among which queue extremes are, voted tracks are at queue head and others follow by order"""
+        split = self.keys.bisect_left((0,))
+        orders = [key[1] for key in self.keys.islice(0, split)]
+        if split < len(self.keys):
+            orders += [self.keys[split][1], self.keys[-1][1]]
+        return orders
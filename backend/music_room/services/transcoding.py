@@ -0,0 +1,252 @@
+import os
+import subprocess
+import tempfile
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from typing import Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from pydub.utils import get_encoder_name
+from tinytag import TinyTag
+
+from audio_export import export_file, file_hash
+from music_room.models import Track, TrackFile
+from . import analysis
+from .streaming import stream_backend
+
+#: Lossless extensions renditions exported from
+LOSSLESS_EXTENSIONS = [TrackFile.Extensions.flac]
+
+
+def export_rendition(file_path: str, extension: str, rendition: dict) -> str:
+    """Encode rendition to temporary file and return its path, run at process pool"""
+    rendition_path = os.path.join(tempfile.gettempdir(), f'{uuid.uuid4().hex}.{rendition["extension"]}')
+    return export_file(file_path, rendition_path, rendition['extension'], rendition['bitrate'], extension)
+
+
+class TranscodingService:
+    """Metadata extraction and transcoding of uploaded track file, run out of request by transcoding queue"""
+    max_attempts = 3  #: Attempts before job marked as failed
+
+    def __init__(self, track_file: TrackFile, processes: Optional[int] = None):
+        self.track_file = track_file
+        #: Processes encoding renditions, TRANSCODING_PROCESSES by default
+        self.processes = processes or getattr(settings, 'TRANSCODING_PROCESSES', 1)
+
+    @classmethod
+    def run(cls, track_file_id: int, processes: Optional[int] = None) -> bool:
+        """Run claimed job, failed job returns to queue until attempts exhausted"""
+        track_file = TrackFile.objects.select_related('track').get(id=track_file_id)
+        try:
+            cls(track_file, processes).process()
+        except Exception as e:
+            status = TrackFile.Statuses.pending if track_file.attempts < cls.max_attempts else TrackFile.Statuses.failed
+            TrackFile.objects.filter(id=track_file.id).update(status=status, error=repr(e), updated_at=timezone.now())
+            return False
+        TrackFile.objects.filter(id=track_file.id).update(
+            status=TrackFile.Statuses.done, error=None, updated_at=timezone.now()
+        )
+        return True
+
+    def local_copy(self) -> Tuple[str, bool]:
+        """Local path of track file, second value is True if path is temporary copy from cloud storage"""
+        try:
+            return default_storage.path(self.track_file.file.name), False
+        except NotImplementedError:
+            ...
+        suffix = os.path.splitext(self.track_file.file.name)[1]
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as local_file:
+            try:
+                for chunk in stream_backend(self.track_file).chunks():
+                    local_file.write(chunk)
+            except Exception:
+                os.unlink(local_file.name)
+                raise
+        return local_file.name, True
+
+    def process(self):
+        file_path, temporary = self.local_copy()
+        try:
+            extension = self.track_file.file.name.split('.')[-1]
+            duration = TinyTag.get(file_path).duration
+            TrackFile.objects.filter(id=self.track_file.id).update(
+                duration=duration, extension=extension, content_hash=self.track_file.content_hash or file_hash(file_path)
+            )
+            self.analyze(file_path)
+            if extension in LOSSLESS_EXTENSIONS:
+                self.export(file_path, extension, duration)
+                if getattr(settings, 'TRANSCODING_SEGMENTS', {}).get('enabled'):
+                    self.segment(file_path)
+        finally:
+            if temporary:
+                os.unlink(file_path)
+
+    def analyze(self, file_path: str):
+        """
+        Compute waveform peaks and loudness once per source file,
+        renditions share peaks of source and copy its loudness
+        """
+        if not self.track_file.peaks:
+            samples = analysis.decode(file_path, analysis.PEAKS_SAMPLE_RATE)
+            name = default_storage.save(f'peaks/{self.track_file.id}.bin', ContentFile(analysis.peaks(samples)))
+            TrackFile.objects.filter(id=self.track_file.id).update(peaks=name)
+        if self.track_file.peak_level is None:
+            loudness = analysis.measure_loudness(file_path)
+            self.track_file.loudness = loudness.loudness
+            self.track_file.peak_level = loudness.peak
+            self.track_file.gain = loudness.gain(getattr(settings, 'PLAYER_TARGET_LOUDNESS', -14))
+            TrackFile.objects.filter(id=self.track_file.id).update(
+                loudness=self.track_file.loudness, peak_level=self.track_file.peak_level, gain=self.track_file.gain
+            )
+
+    def missed_renditions(self) -> List[dict]:
+        exported = set(self.track_file.renditions.values_list('extension', 'bitrate'))
+        return [
+            rendition for rendition in getattr(settings, 'TRANSCODING_RENDITIONS', [])
+            if (rendition['extension'], rendition['bitrate']) not in exported
+        ]
+
+    def rendition_name(self, rendition: dict) -> str:
+        name, _ = os.path.splitext(self.track_file.file.name)
+        return f'{name}_{rendition["bitrate"]}k.{rendition["extension"]}'
+
+    def export(self, file_path: str, extension: str, duration: float):
+        """Export missed renditions of ladder, encoded in parallel by process pool"""
+        renditions = self.missed_renditions()
+        if not renditions:
+            return
+        processes = min(len(renditions), self.processes)
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            futures = [pool.submit(export_rendition, file_path, extension, rendition) for rendition in renditions]
+        exported = [future.result() for future in futures if not future.exception()]
+        try:
+            failed = next((future.exception() for future in futures if future.exception()), None)
+            if failed:
+                raise failed
+            track_files = []
+            for rendition, rendition_path in zip(renditions, exported):
+                with open(rendition_path, 'rb') as rendition_file:
+                    name = default_storage.save(self.rendition_name(rendition), File(rendition_file))
+                track_files.append(TrackFile(
+                    track=self.track_file.track,
+                    source=self.track_file,
+                    file=name,
+                    duration=duration,
+                    extension=rendition['extension'],
+                    bitrate=rendition['bitrate'],
+                    loudness=self.track_file.loudness,
+                    peak_level=self.track_file.peak_level,
+                    gain=self.track_file.gain,
+                    status=TrackFile.Statuses.done,
+                ))
+            TrackFile.objects.bulk_create(track_files)
+        finally:
+            for rendition_path in exported:
+                os.unlink(rendition_path)
+
+    @property
+    def segments_directory(self) -> str:
+        return f'hls/{self.track_file.id}'
+
+    def segment(self, file_path: str):
+        """Package file as HLS, fixed duration segments let clients start playback from any progress"""
+        if TrackFile.objects.filter(id=self.track_file.id).exclude(manifest=None).exclude(manifest='').exists():
+            return
+        options = settings.TRANSCODING_SEGMENTS
+        with tempfile.TemporaryDirectory() as directory:
+            subprocess.run([
+                get_encoder_name(), '-y', '-loglevel', 'error', '-i', file_path, '-vn',
+                '-c:a', 'aac', '-b:a', f'{options["bitrate"]}k',
+                '-f', 'hls', '-hls_time', str(options['duration']), '-hls_playlist_type', 'vod',
+                '-hls_segment_filename', os.path.join(directory, 'segment_%05d.ts'),
+                os.path.join(directory, 'index.m3u8')
+            ], check=True, capture_output=True)
+            for name in sorted(os.listdir(directory), key=lambda name: (name.endswith('.m3u8'), name)):
+                stored_name = f'{self.segments_directory}/{name}'
+                if default_storage.exists(stored_name):
+                    default_storage.delete(stored_name)
+                with open(os.path.join(directory, name), 'rb') as segment:
+                    default_storage.save(stored_name, File(segment))
+        TrackFile.objects.filter(id=self.track_file.id).update(manifest=f'{self.segments_directory}/index.m3u8')
+
+    @staticmethod
+    def pick(track: Track, bitrate: Optional[int] = None, extensions: Iterable[str] = None) -> Optional[TrackFile]:
+        """
+        Rendition for client, highest bitrate not above requested,
+        lowest one if all above, source file if bitrate not requested
+        """
+        files = TrackFile.objects.filter(track=track, status=TrackFile.Statuses.done)
+        if extensions:
+            files = files.filter(extension__in=extensions)
+        if not bitrate:
+            return files.filter(source=None).first() or files.order_by('-bitrate').first()
+        return (
+            files.filter(bitrate__lte=bitrate).order_by('-bitrate').first() or
+            files.exclude(bitrate=None).order_by('bitrate').first()
+        )
+
+
+class TranscodingQueue:
+    """Transcoding jobs are pending track files, queue decides where they are processed"""
+
+    def enqueue(self, track_file: TrackFile):
+        ...
+
+
+class DatabaseQueue(TranscodingQueue):
+    """Jobs kept as track file status, processed by ``transcode_worker`` command"""
+    stale_after = timedelta(minutes=30)  #: Processing job without progress considered lost by crashed worker
+
+    def claim(self) -> Optional[int]:
+        """Take oldest pending job, concurrent workers skip jobs locked by others"""
+        with transaction.atomic():
+            track_file_id = TrackFile.objects.select_for_update(skip_locked=True).filter(
+                Q(status=TrackFile.Statuses.pending) |
+                Q(status=TrackFile.Statuses.processing, updated_at__lt=timezone.now() - self.stale_after)
+            ).order_by('updated_at').values_list('id', flat=True).first()
+            if track_file_id is None:
+                return None
+            TrackFile.objects.filter(id=track_file_id).update(
+                status=TrackFile.Statuses.processing, attempts=F('attempts') + 1, updated_at=timezone.now()
+            )
+        return track_file_id
+
+
+class LocalQueue(TranscodingQueue):
+    """Jobs processed in process right after transaction commit, for tests and development without worker"""
+
+    def enqueue(self, track_file: TrackFile):
+        def run():
+            for _ in range(TranscodingService.max_attempts):
+                TrackFile.objects.filter(id=track_file.id).update(
+                    status=TrackFile.Statuses.processing, attempts=F('attempts') + 1, updated_at=timezone.now()
+                )
+                if TranscodingService.run(track_file.id):
+                    return
+
+        transaction.on_commit(run)
+
+
+queues = {
+    'database': DatabaseQueue,
+    'local': LocalQueue,
+}
+
+
+def transcoding_queue() -> TranscodingQueue:
+    return queues[getattr(settings, 'TRANSCODING_QUEUE', 'database')]()
+
+
+@receiver(post_save, sender=TrackFile)
+def file_post_save(instance: TrackFile, created, **kwargs):
+    if created and instance.file and instance.status == TrackFile.Statuses.pending:
+        transcoding_queue().enqueue(instance)
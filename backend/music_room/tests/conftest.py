@@ -0,0 +1,52 @@
+from typing import List
+
+import pytest
+from django.core.cache import cache
+
+from music_room.models import Artist, PlayerSession, Playlist, PlaylistTrack, Track, User
+from music_room.services.queue import QueueEngine
+
+
+@pytest.fixture
+def user() -> User:
+    return User.objects.create_user(username='author', password='password')
+
+
+@pytest.fixture
+def users() -> List[User]:
+    return [User.objects.create_user(username=f'user{i}', password='password') for i in range(4)]
+
+
+@pytest.fixture
+def tracks() -> List[Track]:
+    artist = Artist.objects.create(name='Artist')
+    return [Track.objects.create(name=f'Track {i}', artist=artist) for i in range(6)]
+
+
+@pytest.fixture
+def player_session(user: User, tracks: List[Track]) -> PlayerSession:
+    playlist = Playlist.objects.create(name='Playlist', author=user)
+    PlaylistTrack.objects.bulk_create([
+        PlaylistTrack(playlist=playlist, track=track, order=i) for i, track in enumerate(tracks)
+    ])
+    return PlayerSession.objects.create(playlist=playlist, author=user)
+
+
+@pytest.fixture(autouse=True)
+def clean_engines():
+    """Engines and cache are process wide, every test starts without live sessions"""
+    cache.clear()
+    yield
+    with QueueEngine.engines_lock:
+        engines, QueueEngine.engines = list(QueueEngine.engines.values()), {}
+        QueueEngine.consumers, QueueEngine.evicted_at = {}, 0
+    for engine in engines:
+        if engine.timer:
+            engine.timer.cancel()
+    cache.clear()
+
+
+@pytest.fixture
+def shared(monkeypatch):
+    """Queue engines shared between workers, as with Redis cache"""
+    monkeypatch.setattr(QueueEngine, 'shared', True)
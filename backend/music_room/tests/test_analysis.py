@@ -0,0 +1,31 @@
+import numpy as np
+
+from music_room.services import analysis
+
+
+def sine(level: float, frequency: float = 1000, seconds: int = 5) -> np.ndarray:
+    """Stereo 16-bit sine at level in dBFS"""
+    frames = np.arange(analysis.LOUDNESS_SAMPLE_RATE * seconds)
+    samples = 10 ** (level / 20) * 32768 * np.sin(2 * np.pi * frequency * frames / analysis.LOUDNESS_SAMPLE_RATE)
+    samples = np.round(samples).astype(np.int16)
+    return np.column_stack((samples, samples))
+
+
+def test_sine_loudness():
+    # Stereo 1 kHz sine at -23 dBFS reads -23 LUFS (EBU Tech 3341)
+    samples = sine(-23)
+    blocks = (samples[offset:offset + analysis.LOUDNESS_STEP * 10] for offset in range(0, len(samples), 48000))
+    loudness = analysis.loudness(blocks)
+    assert abs(loudness.loudness + 23) <= 0.1
+    assert abs(loudness.peak + 23) <= 0.01
+    assert abs(loudness.gain(-14) - 9) <= 0.1
+
+
+def test_gain_limited_by_peak():
+    assert analysis.Loudness(loudness=-20, peak=-3).gain(-14) == 3
+    assert analysis.Loudness(loudness=-10, peak=-1).gain(-14) == -4
+
+
+def test_silence_loudness():
+    loudness = analysis.loudness(iter([np.zeros((analysis.LOUDNESS_STEP * 10, 2), dtype=np.int16)]))
+    assert loudness.loudness is None and loudness.peak is None and loudness.gain(-14) is None
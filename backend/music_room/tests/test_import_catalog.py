@@ -0,0 +1,40 @@
+import pytest
+from django.core.files.storage import default_storage
+
+from music_room.management.commands.import_catalog import Command, Probe
+from music_room.models import Artist, Track, TrackFile
+
+
+@pytest.fixture
+def storage(settings, tmp_path):
+    settings.DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
+    settings.MEDIA_ROOT = str(tmp_path / 'media')
+
+
+def probe(tmp_path, artist: str, title: str) -> Probe:
+    path = tmp_path / f'{artist} - {title}.mp3'
+    path.write_bytes(f'{artist} {title}'.encode())
+    return Probe(
+        path=str(path), content_hash=f'{artist}-{title}', extension='mp3', artist=artist, title=title, duration=1.0
+    )
+
+
+@pytest.mark.django_db
+def test_import_probes_reports_track_name_of_another_artist(storage, tmp_path):
+    Track.objects.create(name='Intro', artist=Artist.objects.create(name='First'))
+    probes = [
+        probe(tmp_path, 'First', 'Intro'),
+        probe(tmp_path, 'Second', 'Intro'),
+        probe(tmp_path, 'Second', 'Outro'),
+        probe(tmp_path, 'Third', 'Outro'),
+    ]
+
+    conflicts = Command.import_probes(probes, uploads=2)
+
+    assert conflicts == [probes[1], probes[3]]
+    assert sorted(TrackFile.objects.values_list('track__artist__name', 'track__name')) == [
+        ('First', 'Intro'), ('Second', 'Outro')
+    ]
+    assert Track.objects.get(name='Intro').files.get().content_hash == 'First-Intro'
+    assert not default_storage.exists('music/Second-Intro.mp3')
+    assert default_storage.exists('music/Second-Outro.mp3')
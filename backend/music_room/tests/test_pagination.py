@@ -0,0 +1,35 @@
+from typing import List
+
+import pytest
+from rest_framework.test import APIClient
+
+from music_room.models import Track, User
+
+
+@pytest.fixture
+def client(user: User) -> APIClient:
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+@pytest.mark.django_db
+def test_list_without_page_params_is_plain_list(client: APIClient, tracks: List[Track]):
+    response = client.get('/api/track/')
+
+    assert response.status_code == 200
+    assert sorted(track['id'] for track in response.json()) == sorted(track.id for track in tracks)
+
+
+@pytest.mark.django_db
+def test_list_pages_follow_next(client: APIClient, tracks: List[Track]):
+    page = client.get('/api/track/', {'page_size': 4}).json()
+    assert page['previous'] is None
+    ids = [track['id'] for track in page['results']]
+    assert len(ids) == 4
+
+    page = client.get(page['next']).json()
+    ids += [track['id'] for track in page['results']]
+
+    assert page['next'] is None
+    assert ids == sorted(track.id for track in tracks)
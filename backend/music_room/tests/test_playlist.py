@@ -0,0 +1,44 @@
+from typing import List
+
+import pytest
+
+from music_room.models import ORDER_STEP, Playlist, PlaylistTrack, Track, User
+from music_room.services import PlaylistService
+
+
+@pytest.fixture
+def playlist(user: User, tracks: List[Track]) -> Playlist:
+    playlist = Playlist.objects.create(name='Playlist', author=user)
+    for i, track in enumerate(tracks):
+        PlaylistTrack.objects.create(playlist=playlist, track=track, order=i * ORDER_STEP)
+    return playlist
+
+
+def playlist_orders(playlist: Playlist) -> List[tuple]:
+    return list(playlist.tracks.values_list('track_id', 'order'))
+
+
+@pytest.mark.django_db
+def test_move_track_inside_gap_updates_one_row(playlist, tracks, django_assert_num_queries):
+    before = dict(playlist_orders(playlist))
+
+    with django_assert_num_queries(2):  # Playlist tracks, then moved row
+        assert PlaylistService(playlist).move_track(tracks[-1], 1) == 1
+
+    after = dict(playlist_orders(playlist))
+    assert [track_id for track_id, _ in playlist_orders(playlist)] == [tracks[0].id, tracks[-1].id] + [
+        track.id for track in tracks[1:-1]
+    ]
+    assert {track_id: order for track_id, order in after.items() if order != before[track_id]} == {
+        tracks[-1].id: ORDER_STEP // 2
+    }
+
+
+@pytest.mark.django_db
+def test_move_track_without_gap_renumbers_playlist(playlist, tracks):
+    PlaylistTrack.objects.filter(playlist=playlist, track=tracks[1]).update(order=1)
+    moved = PlaylistService(playlist.id).move_track(tracks[-1].id, 1)
+    assert moved > 1
+    assert [track_id for track_id, _ in playlist_orders(playlist)] == [tracks[0].id, tracks[-1].id] + [
+        track.id for track in tracks[1:-1]
+    ]
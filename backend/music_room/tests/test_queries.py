@@ -0,0 +1,42 @@
+from typing import List
+
+import pytest
+
+from music_room.models import PlayerSession, Track, User
+from music_room.serializers import PlayerSessionSerializer, TrackSerializer
+from music_room.services import PlayerService
+from music_room.services.queue import QueueEngine
+
+
+@pytest.mark.django_db
+def test_queue_snapshot_queries(player_session, django_assert_num_queries):
+    # Session and prefetched queue, tracks count does not matter
+    with django_assert_num_queries(2):
+        instance = PlayerSessionSerializer.prefetch(PlayerSession.objects.filter(id=player_session.id)).get()
+        assert len(PlayerSessionSerializer(instance).data['track_queue']) == 6
+
+    # Live engine serves queue from memory
+    QueueEngine.get(player_session)
+    with django_assert_num_queries(1):
+        instance = PlayerSession.objects.get(id=player_session.id)
+        assert len(PlayerSessionSerializer(instance).data['track_queue']) == 6
+
+
+@pytest.mark.django_db
+def test_tracks_list_queries(tracks, django_assert_num_queries):
+    with django_assert_num_queries(2):
+        assert len(TrackSerializer(TrackSerializer.prefetch(Track.objects.all()), many=True).data) == 6
+
+
+@pytest.mark.django_db
+def test_vote_queries(player_session, users: List[User], django_assert_num_queries):
+    track_id = QueueEngine.get(player_session).tracks[-1].id
+
+    # Same queries for every voter: session lookup, then lock, toggle, count and store votes in savepoint
+    for user in users:
+        with django_assert_num_queries(8):
+            player_service = PlayerService(player_session.id)
+            with player_service.locked():
+                player_service.vote(track_id, user)
+                patch = player_service.commit()
+        assert [change.track.id for change in patch.changes] == [track_id]
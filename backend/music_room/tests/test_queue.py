@@ -0,0 +1,202 @@
+import io
+import threading
+import time
+from typing import List
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+
+from music_room.models import ORDER_STEP, PlayerSession, SessionTrack
+from music_room.serializers import PlayerSessionPatchSerializer, PlayerSessionSerializer
+from music_room.services import PlayerService
+from music_room.services.ordering import shuffled
+from music_room.services.queue import QueueEngine, QueuePatch
+
+
+def database_queue(player_session: PlayerSession) -> List[tuple]:
+    return list(SessionTrack.objects.filter(playersession=player_session).values_list('id', 'order', 'votes_count'))
+
+
+def engine_queue(engine: QueueEngine) -> List[tuple]:
+    return sorted((track.id, track.order, track.votes_count) for track in engine.tracks)
+
+
+@pytest.mark.django_db
+def test_shared_commit_behind_database_reloads_queue(player_session, shared):
+    first, second = QueueEngine(player_session), QueueEngine(player_session)
+    tracks = first.tracks
+
+    first.delay(tracks[-1].id)
+    patch = first.commit()
+    assert patch.version == 1 and not patch.reset
+
+    # Second worker missed first commit, its change must not overwrite database
+    second.delay(tracks[-2].id)
+    patch = second.commit()
+    assert patch.reset and patch.version == 2 and patch.previous_version == 1
+    assert [change.track.id for change in patch.changes] == [track.id for track in first.tracks]
+    assert PlayerSession.objects.get(id=player_session.id).version == 2
+    assert engine_queue(second) == sorted(database_queue(player_session)) == engine_queue(first)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_two_shared_workers_keep_one_queue(player_session, shared):
+    workers = [QueueEngine(player_session), QueueEngine(player_session)]
+    track_ids = [track.id for track in workers[0].tracks]
+    patches: List[QueuePatch] = []
+    errors = []
+
+    def run(engine: QueueEngine, moved: List[int]):
+        try:
+            for _ in range(5):
+                for track_id in moved:
+                    with engine.locked():
+                        engine.delay(track_id)
+                        patches.append(engine.commit())
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [
+        threading.Thread(target=run, args=(workers[0], track_ids[1::2])),
+        threading.Thread(target=run, args=(workers[1], track_ids[2::2])),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert sorted(patch.version for patch in patches) == list(range(1, len(patches) + 1))
+    assert not any(patch.reset for patch in patches)
+    assert PlayerSession.objects.get(id=player_session.id).version == len(patches)
+    rows = database_queue(player_session)
+    assert len({order for _, order, _ in rows}) == len(rows)
+    for engine in workers:
+        with engine.locked():
+            assert engine_queue(engine) == sorted(rows)
+
+
+@pytest.mark.django_db
+def test_rebalance_command_reloads_live_engine(player_session):
+    engine = QueueEngine.get(player_session)
+    tracks = engine.tracks
+    engine.update(tracks[1], order=tracks[0].order + 1)
+    engine.commit()
+    engine.flush()
+    engine.update(tracks[3], progress=10)  # Pending write-behind change
+
+    call_command('rebalance_orders', stdout=io.StringIO())
+    rows = database_queue(player_session)
+    assert [order for _, order, _ in sorted(rows, key=lambda row: row[1])] == [i * ORDER_STEP for i in range(len(rows))]
+
+    engine = QueueEngine.get(PlayerSession.objects.get(id=player_session.id))
+    assert engine_queue(engine) == sorted(rows)
+    engine.flush()
+    assert database_queue(player_session) == rows
+    assert engine.commit().reset
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_votes_keep_one_vote_per_user(player_session, users):
+    track_id = QueueEngine(player_session).tracks[-1].id
+    barrier = threading.Barrier(len(users))
+    errors = []
+
+    def run(user_id: int, toggles: int):
+        try:
+            barrier.wait()
+            for _ in range(toggles):
+                QueueEngine.toggle_vote(track_id, user_id)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    # Odd toggles leave vote, even toggles take it back
+    toggles = {user.id: 3 if i % 2 else 4 for i, user in enumerate(users)}
+    threads = [threading.Thread(target=run, args=item) for item in toggles.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    voters = list(SessionTrack.votes.through.objects.filter(sessiontrack_id=track_id).values_list('user_id', flat=True))
+    assert sorted(voters) == sorted(user_id for user_id, count in toggles.items() if count % 2)
+    assert SessionTrack.objects.get(id=track_id).votes_count == (len(voters) if len(voters) > 1 else 0)
+
+
+def apply_patch(snapshot: dict, patch: dict) -> dict:
+    """Apply serialized patch to serialized session as client does, see :class:`QueuePatch`"""
+    assert patch['previous_version'] == snapshot['version']
+    tracks = [dict(track) for track in snapshot['track_queue']]
+    if patch['seed'] is not None:
+        shuffled_tracks = sorted(tracks[1:], key=lambda track: (track['order'], track['id']))
+        orders = [track['order'] for track in shuffled_tracks]
+        for track, order in zip(shuffled(shuffled_tracks, patch['seed']), orders):
+            track['order'] = order
+        tracks.sort(key=lambda track: (-track['votes_count'], track['order'], track['id']))
+    if patch['reset']:
+        tracks = []
+    dropped = set(patch['removed']) | {change['track']['id'] for change in patch['changes']}
+    tracks = [track for track in tracks if track['id'] not in dropped]
+    for change in patch['changes']:
+        tracks.insert(change['position'], change['track'])
+    return {**snapshot, 'version': patch['version'], 'track_queue': tracks}
+
+
+@pytest.mark.django_db
+def test_patch_applied_to_shuffled_session_snapshot(player_session):
+    # Session created shuffled, as CreateSession does
+    player_service = PlayerService(player_session)
+    with player_service.locked():
+        player_service.shuffle(42)
+        player_service.commit()
+    snapshot = PlayerSessionSerializer(player_session).data
+    assert [track['id'] for track in snapshot['track_queue']] == [track.id for track in player_service.queue.tracks]
+
+    actions = [lambda service: service.delay_play_track(service.queue.tracks[-1].id), lambda service: service.shuffle(7)]
+    for action in actions:
+        player_service = PlayerService(player_session.id)
+        with player_service.locked():
+            action(player_service)
+            patch = PlayerSessionPatchSerializer(player_service.commit()).data
+        snapshot = apply_patch(snapshot, patch)
+        assert snapshot == PlayerSessionSerializer(player_service.player_session).data
+
+
+@pytest.mark.django_db
+def test_engine_dropped_after_last_consumer_disconnected(player_session):
+    QueueEngine.attach(player_session.id)
+    QueueEngine.attach(player_session.id)
+    engine = QueueEngine.get(player_session)
+    engine.delay(engine.tracks[-1].id)
+    engine.commit()
+
+    QueueEngine.detach(player_session.id)
+    assert QueueEngine.peek(player_session.id) is engine
+
+    QueueEngine.detach(player_session.id)
+    assert QueueEngine.peek(player_session.id) is None
+    assert engine_queue(engine) == sorted(database_queue(player_session))
+    assert PlayerSession.objects.get(id=player_session.id).version == 1
+
+
+@pytest.mark.django_db
+def test_idle_engine_without_consumers_evicted(player_session, users, monkeypatch):
+    idle = QueueEngine.get(player_session)
+    idle.delay(idle.tracks[-1].id)
+    idle.commit()
+    other = PlayerSession.objects.create(playlist=player_session.playlist, author=users[0])
+    QueueEngine.attach(other.id)
+    QueueEngine.get(other)
+
+    monkeypatch.setattr(time, 'monotonic', lambda now=time.monotonic(): now + QueueEngine.idle_timeout + 1)
+    QueueEngine.get(other)
+
+    assert QueueEngine.peek(player_session.id) is None
+    assert QueueEngine.peek(other.id) is not None
+    assert engine_queue(idle) == sorted(database_queue(player_session))
@@ -0,0 +1,93 @@
+import json
+import threading
+from typing import List, Type
+
+import pytest
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
+
+from music_room.models import PlayerSession, User
+from music_room.services import PlayerService
+from ws.base import ActionSystem, Message, ResponsePayload
+from ws.player import PlayerConsumer
+
+fakeredis = pytest.importorskip('fakeredis')
+
+
+@pytest.fixture
+def redis_url() -> str:
+    """Throwaway Redis speaking real protocol, shared by channel layers and cache of workers"""
+    server = fakeredis.TcpFakeServer(('127.0.0.1', 0), server_type='redis')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    yield f'redis://{host}:{port}'
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def workers(settings, redis_url, shared) -> List[Type[PlayerConsumer]]:
+    """Player consumers of two workers, every worker with own Redis channel layer, cache at same Redis"""
+    settings.CACHES = {'default': {'BACKEND': 'django_redis.cache.RedisCache', 'LOCATION': f'{redis_url}/0'}}
+    settings.CHANNEL_LAYERS = {
+        f'worker-{i}': {'BACKEND': 'channels_redis.core.RedisChannelLayer', 'CONFIG': {'hosts': [redis_url]}}
+        for i in (1, 2)
+    }
+    return [type(f'Worker{i}PlayerConsumer', (PlayerConsumer,), {'channel_layer_alias': f'worker-{i}'}) for i in (1, 2)]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_two_workers_receive_one_patch(workers, player_session, user: User, monkeypatch):
+    seeds = []
+    shuffle = PlayerService.shuffle
+    monkeypatch.setattr(PlayerService, 'shuffle', lambda self, seed=None: seeds.append(seed) or shuffle(self, seed))
+
+    async def run() -> List[dict]:
+        sockets = []
+        for consumer in workers:
+            socket = WebsocketCommunicator(consumer.as_asgi(), '/ws/player/')
+            socket.scope['user'] = user
+            connected, _ = await socket.connect()
+            assert connected
+            assert (await socket.receive_json_from(timeout=5))['event'] == 'session'
+            sockets.append(socket)
+
+        await sockets[0].send_json_to({
+            'event': 'shuffle', 'payload': {'shuffle': {'player_session_id': player_session.id, 'seed': 42}}
+        })
+        received = [await socket.receive_json_from(timeout=5) for socket in sockets]
+        for socket in sockets:
+            assert await socket.receive_nothing(timeout=0.5)
+            await socket.disconnect()
+        return received
+
+    initiator, target = async_to_sync(run)()
+
+    assert initiator == target
+    assert initiator['event'] == 'session.patched'
+    patch = initiator['payload']['sessionPatched']['player_session_patch']
+    assert patch['version'] == 1 and patch['previous_version'] == 0 and patch['seed'] == 42
+    # Before send ran by one worker only
+    assert seeds == [42]
+    assert PlayerSession.objects.get(id=player_session.id).version == 1
+
+
+def test_receiver_reports_before_send_not_finished_in_time(monkeypatch):
+    monkeypatch.setattr(Message, 'before_send_timeout', 0.05)
+    # Other receiver acquired before send and never finished it
+    monkeypatch.setattr(Message, 'before_send_acquire', lambda self: False)
+    consumer = PlayerConsumer()
+    consumer.channel_name, consumer.scope = 'receiver', {'user': AnonymousUser()}
+    sent = []
+    consumer.base_send = lambda message: sent.append(json.loads(message['text']))
+    rendered = []
+
+    consumer.run(consumer.broadcast_steps(
+        {'type': 'session', 'payload': {}, 'system': ActionSystem(initiator_channel='initiator').to_data()},
+        action_for_target=lambda message, payload: rendered.append(message),
+        before_send=lambda message, payload: None
+    ))
+
+    assert not rendered
+    assert sent == [{'event': 'error', 'payload': {'error': ResponsePayload.BeforeSendTimeout().to_data()}}]
@@ -7,7 +7,8 @@ from rest_framework.authentication import BasicAuthentication
 
 from .views import TrackListView, PlaylistListView, PlaylistOwnListView, PlayerSessionRetrieveView, AuthView, \
     TokenRefreshWithExpiresView, UserListView, ArtistListView, ArtistRetrieveView, PlaylistRetrieveView, \
-    EventCreateView, EventListView
+    EventCreateView, EventListView, TrackFileStreamView, TrackFileSegmentView, TrackFilePeaksView, \
+    TrackStreamView
 
 
 class BothHttpAndHttpsSchemaGenerator(OpenAPISchemaGenerator):
@@ -35,6 +36,10 @@ urlpatterns = [
     re_path(r'^$', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     re_path(r'^redoc/$', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
     path('track/', TrackListView.as_view()),
+    path('track/<int:pk>/stream/', TrackStreamView.as_view()),
+    path('track/file/<int:pk>/stream/', TrackFileStreamView.as_view()),
+    path('track/file/<int:pk>/peaks/', TrackFilePeaksView.as_view()),
+    re_path(r'^track/file/(?P<pk>\d+)/hls/(?P<name>[\w-]+\.(?:m3u8|ts))$', TrackFileSegmentView.as_view()),
     path('playlist/', PlaylistListView.as_view()),
     path('playlist/<int:pk>/', PlaylistRetrieveView.as_view()),
     path('playlist/own/', PlaylistOwnListView.as_view()),
@@ -1,20 +1,66 @@
+import os
+
 from django.contrib.auth import get_user_model, authenticate, login
-from django.db.models import Q
+from django.core.files.storage import default_storage
+from django.db.models import Q, QuerySet
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse, Http404
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, parse_http_date_safe
+from drf_yasg import openapi
 from drf_yasg.utils import swagger_auto_schema
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import ListAPIView, RetrieveAPIView, CreateAPIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
-from .models import Track, Playlist, PlayerSession, Artist, Event
+from .models import Track, Playlist, PlayerSession, Artist, Event, TrackFile
+from .services.streaming import stream_backend, parse_range, LocalStreamBackend
+from .services.transcoding import TranscodingService
 from .serializers import TrackSerializer, PlaylistSerializer, PlayerSessionSerializer, UserSerializer, \
     TokenObtainPairSerializer, TokenRefreshSerializer, TokenResponseSerializer, ArtistSerializer, EventCreateSerializer, \
-    EventListSerializer
+    EventListSerializer, FileSerializer
 
 User = get_user_model()
 
 
-class TrackListView(ListAPIView):
+class QueryFilterMixin:
+    """Filter list queryset by query params, declared as ``{param: (lookup, cast)}``"""
+    query_filters = {}
+
+    def filter_queryset(self, queryset: QuerySet):
+        queryset = super(QueryFilterMixin, self).filter_queryset(queryset)
+        lookups = {}
+        for param, (lookup, cast) in self.query_filters.items():
+            value = self.request.query_params.get(param)
+            if value is None:
+                continue
+            try:
+                value = cast(value)
+            except (TypeError, ValueError):
+                value = None
+            if value is None:
+                raise ValidationError({param: 'Wrong value'})
+            lookups[lookup] = value
+        return queryset.filter(**lookups)
+
+
+def query_parameters(query_filters: dict) -> list:
+    """Swagger query parameters of :attr:`QueryFilterMixin.query_filters`"""
+    return [
+        openapi.Parameter(param, openapi.IN_QUERY, type=openapi.TYPE_STRING, required=False)
+        for param in query_filters
+    ]
+
+
+class PrefetchViewMixin:
+    """Apply serializer prefetch plan (see :class:`PrefetchSerializerMixin`) to view queryset"""
+    def filter_queryset(self, queryset):
+        queryset = super(PrefetchViewMixin, self).filter_queryset(queryset)
+        return self.get_serializer_class().prefetch(queryset)
+
+
+class TrackListView(QueryFilterMixin, PrefetchViewMixin, ListAPIView):
     """
     Tracks
 
@@ -22,9 +68,154 @@ class TrackListView(ListAPIView):
     """
     queryset = Track.objects.all()
     serializer_class = TrackSerializer
+    query_filters = {'artist': ('artist_id', int)}
 
+    @swagger_auto_schema(manual_parameters=query_parameters(query_filters))
+    def get(self, request, *args, **kwargs):
+        return super(TrackListView, self).get(request, *args, **kwargs)
 
-class PlaylistListView(ListAPIView):
+
+class TrackFileStreamView(RetrieveAPIView):
+    """
+    Track file stream
+
+    Stream track file audio, supports byte ranges (Range, If-Range) and conditional requests (ETag, Last-Modified)
+    """
+    queryset = TrackFile.objects.filter(status=TrackFile.Statuses.done)
+    serializer_class = FileSerializer
+
+    def get_track_file(self) -> TrackFile:
+        return self.get_object()
+
+    @swagger_auto_schema(responses={200: 'Audio file', 206: 'Audio file part', 304: 'Not modified', 416: 'Wrong range'})
+    def get(self, request, *args, **kwargs):
+        backend = stream_backend(self.get_track_file())
+        stat = backend.stat()
+        headers = {
+            'Accept-Ranges': 'bytes',
+            'ETag': stat.etag,
+            'Last-Modified': http_date(stat.modified_timestamp),
+            'Cache-Control': 'public, max-age=86400',
+        }
+
+        if_none_match = request.headers.get('If-None-Match')
+        if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        if (if_none_match and stat.etag in [etag.strip() for etag in if_none_match.split(',')]) or \
+                (not if_none_match and if_modified_since and stat.modified_timestamp <= if_modified_since):
+            return self.respond(HttpResponse(status=304), headers)
+
+        range_header = request.headers.get('Range')
+        if_range = request.headers.get('If-Range')
+        if if_range and if_range not in [stat.etag, headers['Last-Modified']]:
+            range_header = None
+        byte_range, satisfiable = parse_range(range_header, stat.size)
+        if not satisfiable:
+            return self.respond(HttpResponse(status=416), {**headers, 'Content-Range': f'bytes */{stat.size}'})
+
+        if byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(backend.read(start, end), status=206, content_type=backend.content_type)
+            return self.respond(response, {
+                **headers, 'Content-Range': f'bytes {start}-{end}/{stat.size}', 'Content-Length': end - start + 1
+            })
+        if isinstance(backend, LocalStreamBackend):
+            response = FileResponse(backend.open(), content_type=backend.content_type)
+        else:
+            chunks = backend.read(0, stat.size - 1) if stat.size else []
+            response = StreamingHttpResponse(chunks, content_type=backend.content_type)
+        return self.respond(response, {**headers, 'Content-Length': stat.size})
+
+    @staticmethod
+    def respond(response: HttpResponse, headers: dict) -> HttpResponse:
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+
+class TrackStreamView(TrackFileStreamView):
+    """
+    Track stream
+
+    Stream track rendition with highest bitrate not above requested one, source file if bitrate not requested
+    """
+    queryset = Track.objects.all()
+    serializer_class = TrackSerializer
+
+    def get_track_file(self) -> TrackFile:
+        try:
+            bitrate = int(self.request.query_params.get('bitrate', 0))
+        except ValueError:
+            raise ValidationError({'bitrate': 'Wrong value'})
+        extensions = [extension for extension in self.request.query_params.get('extensions', '').split(',') if extension]
+        track_file = TranscodingService.pick(self.get_object(), bitrate, extensions)
+        if not track_file:
+            raise Http404
+        return track_file
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter('bitrate', openapi.IN_QUERY, type=openapi.TYPE_INTEGER, required=False),
+            openapi.Parameter('extensions', openapi.IN_QUERY, type=openapi.TYPE_STRING, required=False,
+                              description='Comma separated accepted extensions'),
+        ],
+        responses={200: 'Audio file', 206: 'Audio file part', 304: 'Not modified', 416: 'Wrong range'}
+    )
+    def get(self, request, *args, **kwargs):
+        return super(TrackStreamView, self).get(request, *args, **kwargs)
+
+
+class TrackFileSegmentView(RetrieveAPIView):
+    """
+    Track file segments
+
+    HLS manifest (index.m3u8) and its segments of track file, segments are immutable and cached by clients
+    """
+    queryset = TrackFile.objects.filter(status=TrackFile.Statuses.done).exclude(manifest=None).exclude(manifest='')
+    serializer_class = FileSerializer
+    content_types = {
+        '.m3u8': 'application/vnd.apple.mpegurl',
+        '.ts': 'video/mp2t',
+    }
+
+    @swagger_auto_schema(responses={200: 'HLS manifest or segment'})
+    def get(self, request, *args, **kwargs):
+        track_file: TrackFile = self.get_object()
+        name = f'{os.path.dirname(track_file.manifest.name)}/{kwargs["name"]}'
+        if not default_storage.exists(name):
+            raise Http404
+        extension = os.path.splitext(name)[1]
+        response = FileResponse(default_storage.open(name), content_type=self.content_types[extension])
+        response['Cache-Control'] = 'public, max-age=31536000, immutable' if extension == '.ts' else 'no-cache'
+        return response
+
+
+class TrackFilePeaksView(RetrieveAPIView):
+    """
+    Track file peaks
+
+    Waveform of track file for seek bar, min and max int8 pairs of equal windows, renditions share peaks of source.
+    Peaks are immutable and cached by clients
+    """
+    queryset = TrackFile.objects.filter(status=TrackFile.Statuses.done).select_related('source')
+    serializer_class = FileSerializer
+
+    @swagger_auto_schema(responses={200: 'Peaks, application/octet-stream', 304: 'Not modified'})
+    def get(self, request, *args, **kwargs):
+        track_file: TrackFile = self.get_object()
+        peaks = track_file.peaks or (track_file.source.peaks if track_file.source else None)
+        if not peaks:
+            raise Http404
+        etag = f'"peaks-{os.path.basename(peaks.name)}"'
+        if etag in [value.strip() for value in request.headers.get('If-None-Match', '').split(',')]:
+            response = HttpResponse(status=304)
+        else:
+            response = FileResponse(default_storage.open(peaks.name), content_type='application/octet-stream')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, max-age=31536000, immutable'
+        return response
+
+
+class PlaylistListView(QueryFilterMixin, PrefetchViewMixin, ListAPIView):
     """
     Playlists
 
@@ -32,6 +223,7 @@ class PlaylistListView(ListAPIView):
     """
     queryset = Playlist.objects.filter(access_type=Playlist.AccessTypes.public).all()
     serializer_class = PlaylistSerializer
+    query_filters = {'access_type': ('access_type', str)}
 
     def get_queryset(self):
         if not self.request.user.is_authenticated:
@@ -45,10 +237,14 @@ class PlaylistListView(ListAPIView):
             (
                 Q(type__in=[Playlist.Types.default, Playlist.Types.custom])
             )
-        )
+        ).distinct()
+
+    @swagger_auto_schema(manual_parameters=query_parameters(query_filters))
+    def get(self, request, *args, **kwargs):
+        return super(PlaylistListView, self).get(request, *args, **kwargs)
 
 
-class PlaylistRetrieveView(RetrieveAPIView):
+class PlaylistRetrieveView(PrefetchViewMixin, RetrieveAPIView):
     """
     Playlist
 
@@ -72,7 +268,7 @@ class PlaylistRetrieveView(RetrieveAPIView):
         )
 
 
-class PlaylistOwnListView(ListAPIView):
+class PlaylistOwnListView(QueryFilterMixin, PrefetchViewMixin, ListAPIView):
     """
     Playlists own
 
@@ -81,6 +277,7 @@ class PlaylistOwnListView(ListAPIView):
     queryset = Playlist.objects.filter(access_type=Playlist.AccessTypes.public).all()
     serializer_class = PlaylistSerializer
     permission_classes = [IsAuthenticated]
+    query_filters = {'access_type': ('access_type', str)}
 
     def get_queryset(self):
         return Playlist.objects.filter(
@@ -88,6 +285,10 @@ class PlaylistOwnListView(ListAPIView):
             type__in=[Playlist.Types.default, Playlist.Types.custom]
         )
 
+    @swagger_auto_schema(manual_parameters=query_parameters(query_filters))
+    def get(self, request, *args, **kwargs):
+        return super(PlaylistOwnListView, self).get(request, *args, **kwargs)
+
 
 class PlayerSessionRetrieveView(RetrieveAPIView):
     """
@@ -100,7 +301,7 @@ class PlayerSessionRetrieveView(RetrieveAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_object(self):
-        return PlayerSession.objects.filter(author=self.request.user).first()
+        return PlayerSessionSerializer.prefetch(PlayerSession.objects.filter(author=self.request.user)).first()
 
 
 class AuthView(TokenObtainPairView):
@@ -150,7 +351,7 @@ class UserListView(ListAPIView):
         return User.objects.exclude(username=self.request.user.username)
 
 
-class ArtistListView(ListAPIView):
+class ArtistListView(PrefetchViewMixin, ListAPIView):
     """
     Artists
 
@@ -160,7 +361,7 @@ class ArtistListView(ListAPIView):
     serializer_class = ArtistSerializer
 
 
-class ArtistRetrieveView(RetrieveAPIView):
+class ArtistRetrieveView(PrefetchViewMixin, RetrieveAPIView):
     """
     Artist
 
@@ -181,14 +382,20 @@ class EventCreateView(CreateAPIView):
     permission_classes = [IsAuthenticated]
 
 
-class EventListView(ListAPIView):
+class EventListView(QueryFilterMixin, ListAPIView):
     """
     Events
 
-    Get accessed events
+    Get accessed events, filter by access type and date range (events going on between dates)
     """
     queryset = Event.objects.filter(access_type=Event.AccessTypes.public).all()
     serializer_class = EventListSerializer
+    pagination_ordering = ('start_date', 'id')
+    query_filters = {
+        'access_type': ('access_type', str),
+        'date_from': ('end_date__gte', parse_datetime),
+        'date_to': ('start_date__lte', parse_datetime),
+    }
 
     def get_queryset(self):
         if not self.request.user.is_authenticated:
@@ -197,4 +404,8 @@ class EventListView(ListAPIView):
             Q(access_type=Event.AccessTypes.public) |
             Q(event_access_users__user__in=[self.request.user]) |
             Q(author=self.request.user)
-        )
+        ).distinct()
+
+    @swagger_auto_schema(manual_parameters=query_parameters(query_filters))
+    def get(self, request, *args, **kwargs):
+        return super(EventListView, self).get(request, *args, **kwargs)
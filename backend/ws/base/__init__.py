@@ -2,3 +2,4 @@ from .consumer import *
 from .signatures import *
 from .utils import *
 from .decoratos import *
+from .async_consumer import *
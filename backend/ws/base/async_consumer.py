@@ -0,0 +1,224 @@
+"""
+Websocket: Async Base
+====================================
+Async base websocket consumer, event handlers are coroutines and run at event loop,
+database work must be done in explicit sync sections (:func:`channels.db.database_sync_to_async`)
+"""
+
+from __future__ import annotations
+import asyncio
+import time
+import uuid
+from typing import Callable, List, Optional
+
+from channels.consumer import get_handler_name
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+
+from .consumer import BaseEvent, BroadcastMixin, GroupChannels, Step, Steps
+from .decoratos import async_safe
+from .signatures import ResponsePayload, BasePayload, Action, TargetsEnum, Message, ActionSystem
+from .utils import camel_to_snake, user_cache_key
+
+from django.contrib.auth import get_user_model
+
+User = get_user_model()
+
+
+class AsyncBaseEvent(BaseEvent):
+    def __init__(self, consumer: AsyncBaseConsumer, event=None, payload: BasePayload = None):
+        super(AsyncBaseEvent, self).__init__(consumer, event, payload, trigger=False)
+
+    async def trigger(self):
+        if self.hidden:
+            await self.consumer.send_error(ResponsePayload.ActionNotExist())
+            return
+        await self.consumer.send_broadcast(
+            self.event,
+            action_for_target=self.handler('action_for_target'),
+            action_for_initiator=self.handler('action_for_initiator'),
+            target=self.target,
+            before_send=self.handler('before_send'),
+            payload_type=self.request_payload_type,
+            shared_target=self.shared_target
+        )
+
+    def handler(self, name: str) -> Optional[Callable]:
+        """Handler overridden by event, receivers without handlers skip message without leave event loop"""
+        if getattr(type(self), name) is getattr(AsyncBaseEvent, name):
+            return None
+        return getattr(self, name)
+
+    async def before_send(self, message: Message, payload: BaseEvent.request_payload_type):
+        ...
+
+    async def action_for_initiator(self, message: Message, payload: BaseEvent.request_payload_type):
+        ...
+
+    async def action_for_target(self, message: Message, payload: BaseEvent.request_payload_type):
+        ...
+
+
+class AsyncBaseConsumer(BroadcastMixin, AsyncJsonWebsocketConsumer):
+    authed = True
+
+    def __init__(self):
+        super(AsyncBaseConsumer, self).__init__()
+        self.signature_errors: List[BasePayload] = []
+        self.joined_groups = set()
+        attributes = list(filter(lambda attr: not attr.startswith('_') and not attr.startswith('__'), dir(self)))
+        classes = list(filter(lambda cls: hasattr(getattr(self, cls), '__base__'), attributes))
+        events = list(filter(lambda e: issubclass(getattr(self, e), AsyncBaseEvent), classes))
+        for event in events:
+            event_class = getattr(self, event)
+            hidden = getattr(event_class, 'hidden', False)
+            if not hidden:
+                setattr(self, camel_to_snake(event), event_class)
+
+    async def connect(self):
+        if self.authed and self.get_user().is_anonymous:
+            await self.close()
+            return
+        await self.accept()
+        await database_sync_to_async(self.cache_system)()
+        await self.join_group(self.broadcast_group)
+        await self.after_connect()
+
+    async def dispatch(self, message):
+        handler: Callable = getattr(self, get_handler_name(message), None)
+        if hasattr(handler, 'hidden'):
+            handler: AsyncBaseEvent.__class__
+            await handler(consumer=self, event=message).trigger()
+        else:
+            await super(AsyncBaseConsumer, self).dispatch(message)
+
+    async def after_connect(self):
+        ...
+
+    async def before_disconnect(self):
+        ...
+
+    async def disconnect(self, code):
+        await self.before_disconnect()
+        for group_name in list(self.joined_groups):
+            await self.leave_group(group_name)
+
+    async def send_json(self, content, close=False):
+        if 'system' in content:
+            content.pop('system')
+        await super(AsyncBaseConsumer, self).send_json(content, close)
+
+    async def render(self, action: Action) -> str:
+        content = action.to_data()
+        content.pop('system', None)
+        return await self.encode_json(content)
+
+    def cache_system(self):
+        if not self.get_user().is_anonymous:
+            cache.set(user_cache_key(self.get_user()), self.get_systems().to_data(), 40 * 60)
+
+    def get_user(self) -> User:
+        return self.scope.get('user', AnonymousUser())
+
+    async def join_group(self, group_name: str):
+        if group_name:
+            await self.channel_layer.group_add(group_name, self.channel_name)
+            self.joined_groups.add(group_name)
+            if not self.get_user().is_anonymous:
+                await database_sync_to_async(GroupChannels.add)(group_name, self.get_user().id, self.channel_name)
+
+    async def leave_group(self, group_name: str):
+        if group_name:
+            await self.channel_layer.group_discard(group_name, self.channel_name)
+            self.joined_groups.discard(group_name)
+            if not self.get_user().is_anonymous:
+                await database_sync_to_async(GroupChannels.discard)(group_name, self.get_user().id, self.channel_name)
+
+    def get_systems(self) -> ActionSystem:
+        return ActionSystem(
+            initiator_channel=self.channel_name,
+            initiator_user_id=self.scope['user'].id,
+            action_id=str(uuid.uuid4())
+        )
+
+    @async_safe
+    async def receive(self, *arg, **kwargs):
+        await super().receive(*arg, **kwargs)
+
+    @async_safe
+    async def send(self, *arg, **kwargs):
+        await super().send(*arg, **kwargs)
+
+    async def receive_json(self, content, **kwargs):
+        if self.broadcast_group:
+            await self.run(self.receive_steps(content))
+
+    async def send_to_group(self, action: Action, group_name: str = None):
+        await self.channel_layer.group_send(
+            self.broadcast_group if not group_name else group_name, action.to_system_data()
+        )
+
+    async def send_error(self, payload: BasePayload):
+        """Send error to this socket only, without broadcast"""
+        error = self.Error(consumer=self, payload=payload)
+        await self.send_json(content=error(payload).to_data())
+
+    @staticmethod
+    async def before_send_wait(message: Message, interval: float = 0.01) -> bool:
+        """Wait for before send of other receiver without block thread shared by database calls"""
+        deadline = time.monotonic() + message.before_send_timeout
+        while not await database_sync_to_async(cache.get)(message.before_send_done_key):
+            if time.monotonic() > deadline:
+                return False
+            await asyncio.sleep(interval)
+        return True
+
+    @async_safe
+    async def send_broadcast(self, event, action_for_target: Callable = None, action_for_initiator: Callable = None,
+                             target=TargetsEnum.for_all, before_send: Callable = None,
+                             payload_type: BasePayload() = None, shared_target: bool = False):
+        await self.run(self.broadcast_steps(
+            event, action_for_target, action_for_initiator, target, before_send, payload_type, shared_target
+        ))
+
+    async def run(self, steps: Steps):
+        """Same as :meth:`BaseConsumer.run`, steps awaited at event loop"""
+        result, error = None, None
+        while True:
+            try:
+                step = steps.throw(error) if error else steps.send(result)
+            except StopIteration:
+                return
+            try:
+                result, error = await self.run_step(step), None
+            except Exception as e:
+                result, error = None, e
+
+    async def run_step(self, step):
+        if isinstance(step, Step.Call):
+            return await step.function(*step.args)
+        if isinstance(step, Step.Blocking):
+            return await database_sync_to_async(step.function)(*step.args)
+        if isinstance(step, Step.WaitBeforeSend):
+            return await self.before_send_wait(step.message)
+        if isinstance(step, Step.Render):
+            return await self.render(step.action)
+        if isinstance(step, Step.SendAction):
+            await self.send_json(content=step.action.to_data())
+        elif isinstance(step, Step.SendText):
+            await self.send(text_data=step.text)
+        elif isinstance(step, Step.SendError):
+            await self.send_error(step.payload)
+        elif isinstance(step, Step.GroupSend):
+            await self.channel_layer.group_send(step.group, step.data)
+        elif isinstance(step, Step.ChannelSend):
+            await self.channel_layer.send(step.channel, step.data)
+
+    class Error(AsyncBaseEvent):
+        """Show error message"""
+        request_payload_type = ResponsePayload.Error
+
+        async def action_for_initiator(self, message: Message, payload: request_payload_type):
+            return self(payload=ResponsePayload.Error(message=payload.message))
@@ -5,8 +5,12 @@ Base websocket consumer
 """
 
 from __future__ import annotations
+import threading
+import time
 import uuid
-from typing import Callable
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Generator, List, Optional, Set
 
 from asgiref.sync import async_to_sync
 from channels.consumer import get_handler_name
@@ -18,13 +22,126 @@ from django.core.cache import cache
 from .decoratos import auth, safe
 from .signatures import ResponsePayload, BasePayload, Action, TargetsEnum, Message, ActionSystem, \
     MessageSystem
-from .utils import camel_to_snake, user_cache_key, camel_to_dot, dot_to_camel
+from .utils import camel_to_snake, user_cache_key, camel_to_dot, dot_to_camel, find_value
 
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
 
+class RenderedActions:
+    """
+    Process wide cache of rendered target actions
+
+    Receivers of same broadcast in one process share action rendered by first of them,
+    used only for events with target action independent of receiver (see :attr:`BaseEvent.shared_target`)
+    """
+    size = 512  #: Max rendered actions kept
+
+    def __init__(self):
+        self.actions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            return self.actions.get(key)
+
+    def set(self, key: str, rendered: str):
+        with self.lock:
+            self.actions[key] = rendered
+            if len(self.actions) > self.size:
+                self.actions.popitem(last=False)
+
+
+rendered_actions = RenderedActions()
+
+
+class GroupChannels:
+    """
+    Index of user channels joined to broadcast group, maintained on join and leave group
+
+    Targeted actions (:attr:`TargetsEnum.for_user`, :attr:`TargetsEnum.only_for_initiator`)
+    sent directly to target channels instead of wake up every consumer in group,
+    missed index falls back to group send
+
+    Every channel kept with own expiry refreshed on join, so channels of crashed workers expire
+    same as their channel layer group membership. With Redis cache index is sorted set scored by expiry,
+    changed by atomic ZADD and ZREM, otherwise process local cache changed under lock
+    """
+    expiry = 86400  #: Seconds channel kept without refresh, same as channel layer group expiry
+    lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(group_name: str, user_id: int) -> str:
+        return f'group-{group_name}-user-{user_id}-channels'
+
+    @staticmethod
+    def redis():
+        """Redis client of cache, None if cache is not Redis"""
+        try:
+            from django_redis import get_redis_connection
+            return get_redis_connection('default')
+        except (ImportError, NotImplementedError):
+            return None
+
+    @classmethod
+    def get(cls, group_name: str, user_id: int) -> Optional[List[str]]:
+        key, now = cls.cache_key(group_name, user_id), time.time()
+        redis = cls.redis()
+        if redis:
+            channels = [channel.decode() for channel in redis.zrangebyscore(key, now, '+inf')]
+        else:
+            channels = [channel for channel, expires in (cache.get(key) or {}).items() if expires > now]
+        return channels or None
+
+    @classmethod
+    def add(cls, group_name: str, user_id: int, channel_name: str):
+        key, now = cls.cache_key(group_name, user_id), time.time()
+        redis = cls.redis()
+        if redis:
+            with redis.pipeline() as pipeline:
+                pipeline.zremrangebyscore(key, '-inf', now)
+                pipeline.zadd(key, {channel_name: now + cls.expiry})
+                pipeline.expire(key, cls.expiry)
+                pipeline.execute()
+            return
+        with cls.lock:
+            channels = {channel: expires for channel, expires in (cache.get(key) or {}).items() if expires > now}
+            channels[channel_name] = now + cls.expiry
+            cache.set(key, channels, cls.expiry)
+
+    @classmethod
+    def discard(cls, group_name: str, user_id: int, channel_name: str):
+        key = cls.cache_key(group_name, user_id)
+        redis = cls.redis()
+        if redis:
+            redis.zrem(key, channel_name)
+            return
+        with cls.lock:
+            channels = cache.get(key) or {}
+            channels.pop(channel_name, None)
+            if channels:
+                cache.set(key, channels, cls.expiry)
+            else:
+                cache.delete(key)
+
+    @classmethod
+    def targets(cls, consumer, action: Action, target: str) -> Optional[Set[str]]:
+        """Channels to send targeted action directly, None if action must be sent to whole group"""
+        if target == TargetsEnum.only_for_initiator:
+            return {consumer.channel_name}
+        if target != TargetsEnum.for_user:
+            return None
+        recipient_id = find_value(action.payload, 'to_user_id', 'toUserId')
+        username = find_value(action.payload, 'to_username', 'toUsername')
+        if not recipient_id and username:
+            recipient_id = User.objects.filter(username=username).values_list('id', flat=True).first()
+        channels = cls.get(consumer.broadcast_group, recipient_id) if recipient_id else []
+        if channels is None:
+            return None
+        return {consumer.channel_name, *channels}
+
+
 class BaseEvent:
     request_payload_type = BasePayload
     response_payload_type = BasePayload
@@ -32,6 +149,8 @@ class BaseEvent:
     response_payload_type_target = BasePayload
     target = TargetsEnum.for_all
     hidden = False
+    #: Target action same for every receiver, rendered once per process and shared between receivers
+    shared_target = False
     event_name = None
     consumer = None
 
@@ -55,7 +174,7 @@ class BaseEvent:
 
         if trigger:
             if self.hidden:
-                self.consumer.Error(consumer=self.consumer, payload=ResponsePayload.ActionNotExist())
+                self.consumer.send_error(ResponsePayload.ActionNotExist())
                 return
             self.consumer.send_broadcast(
                 event,
@@ -63,7 +182,8 @@ class BaseEvent:
                 action_for_initiator=self.action_for_initiator,
                 target=self.target,
                 before_send=self.before_send,
-                payload_type=self.request_payload_type
+                payload_type=self.request_payload_type,
+                shared_target=self.shared_target
             )
 
     def before_send(self, message: Message, payload: request_payload_type):
@@ -82,13 +202,206 @@ class BaseEvent:
         return Action(event=event.pop('type'), system=event.pop('system'), payload=payload)
 
 
-class BaseConsumer(JsonWebsocketConsumer):
+class Step:
+    """Steps of receive and broadcast flow (see :class:`BroadcastMixin`), result of step sent back to flow"""
+
+    @dataclass
+    class Call:
+        """Call event handler, awaited by async consumer"""
+        function: Callable
+        args: tuple = ()
+
+    @dataclass
+    class Blocking:
+        """Call function using database or cache, run at database thread by async consumer"""
+        function: Callable
+        args: tuple = ()
+
+    @dataclass
+    class WaitBeforeSend:
+        """Wait for before send run by other receiver, result is False if not finished in time"""
+        message: Message
+
+    @dataclass
+    class Render:
+        """Encode action as text frame, result is text"""
+        action: Action
+
+    @dataclass
+    class SendAction:
+        action: Action
+
+    @dataclass
+    class SendText:
+        text: str
+
+    @dataclass
+    class SendError:
+        """Send error to this socket only"""
+        payload: BasePayload
+
+    @dataclass
+    class GroupSend:
+        group: str
+        data: dict
+
+    @dataclass
+    class ChannelSend:
+        channel: str
+        data: dict
+
+
+Steps = Generator[object, Any, None]
+
+
+class BroadcastMixin:
+    """
+    Receive and broadcast flow shared by :class:`BaseConsumer` and :class:`AsyncBaseConsumer`
+
+    Flow written once as generator of :class:`Step`, consumer runs every step by own means
+    (direct call or await, database thread hop) at :meth:`run` and sends its result back to flow
+    """
     broadcast_group = None
-    authed = True
     custom_target_resolver = {}
+    signature_errors: List[BasePayload]
+
+    def check_signature(self, f: Callable):
+        """Build signature by f, errors of missing or unexpected arguments kept until sent by flow"""
+        error = False
+        data = None
+        try:
+            data = f()
+        except TypeError as e:
+            if ' missing ' in str(e):
+                required = str(e).split('argument: ')[1].strip().replace("'", '')
+                self.signature_errors.append(ResponsePayload.PayloadSignatureWrong(required=required))
+                error = True
+            if ' unexpected ' in str(e):
+                unexpected = str(e).split('argument')[1].strip().replace("'", '')
+                self.signature_errors.append(ResponsePayload.ActionSignatureWrong(unexpected=unexpected))
+                error = True
+        return data, error
+
+    def parse_payload(self, event, payload_type: BasePayload()):
+        payload = BasePayload(**event['payload'])
+        error = False
+        if payload_type:
+            payload, error = self.check_signature(lambda: payload_type(**payload.to_data()))
+        return payload, error
+
+    def signature_error_steps(self) -> Steps:
+        errors, self.signature_errors = self.signature_errors, []
+        for error in errors:
+            yield Step.SendError(error)
+
+    def receive_steps(self, content: dict) -> Steps:
+        """Route action received from socket to its targets, whole group if targets unknown"""
+        action, error = self.check_signature(lambda: Action(**content, system=self.get_systems()))
+        if error:
+            yield from self.signature_error_steps()
+            return
+        if not action:
+            return
+        action_handler = getattr(self, get_handler_name(action.to_system_data()), None)
+        if not action_handler:
+            yield Step.SendError(ResponsePayload.ActionNotExist())
+            return
+        action_handler.consumer = self
+        channels = yield Step.Blocking(GroupChannels.targets, (self, action, getattr(action_handler, 'target', None)))
+        if channels is None:
+            yield Step.GroupSend(self.broadcast_group, action.to_system_data())
+            return
+        for channel in channels:
+            yield Step.ChannelSend(channel, action.to_system_data())
+
+    def broadcast_steps(self, event, action_for_target: Callable = None, action_for_initiator: Callable = None,
+                        target=TargetsEnum.for_all, before_send: Callable = None,
+                        payload_type: BasePayload() = None, shared_target: bool = False) -> Steps:
+        """
+        Handle broadcast action at one receiver
+
+        Before send runs once per action by first receiver, others wait for it, so every action rendered
+        after its changes. Target action of :attr:`BaseEvent.shared_target` event rendered once per process
+        """
+        payload, error = self.parse_payload(event, payload_type)
+        if error:
+            yield from self.signature_error_steps()
+            return
+
+        message = Message(
+            **payload.to_data(),
+            system=MessageSystem(
+                **ActionSystem(**event['system']).to_data(),
+                receiver_channel=self.channel_name
+            ),
+            user=self.scope['user'],
+            target=target,
+            custom_target_resolver=self.custom_target_resolver
+        )
+
+        if message.target == TargetsEnum.for_user and message.is_initiator:
+            if not (yield Step.Blocking(lambda: message.target_user)):
+                yield Step.SendError(ResponsePayload.RecipientNotExist())
+                return  # Interrupt action for initiator and action for target if recipient not found
+
+        is_initiator = message.is_initiator and action_for_initiator
+        is_target = False
+        if action_for_target:
+            # Custom target resolvers may use database, builtin targets resolved without it
+            if message.target in self.custom_target_resolver and not message.is_initiator:
+                is_target = yield Step.Blocking(lambda: message.is_target)
+            else:
+                is_target = message.is_target
+
+        def before():
+            """Run before send once per action, result is readiness to send and action it activated"""
+            if not before_send:
+                return True, None
+            if not (yield Step.Blocking(message.before_send_acquire)):
+                # Other receiver runs before send, render only after its changes
+                if not (yield Step.WaitBeforeSend(message)):
+                    yield Step.SendError(ResponsePayload.BeforeSendTimeout())
+                    return False, None
+                return True, None
+            try:
+                return True, (yield Step.Call(before_send, (message, payload)))
+            finally:
+                yield Step.Blocking(message.before_send_complete)
+
+        if is_initiator:
+            ready, activated = yield from before()
+            if not ready:
+                return
+            action: Action = yield Step.Call(action_for_initiator, (message, payload))
+            if action:
+                yield Step.SendAction(action)
+            if isinstance(activated, Action):
+                yield Step.SendAction(activated)
+
+        if is_target:
+            rendered_key = f'{message.system.action_id}-{event["type"]}'
+            rendered = rendered_actions.get(rendered_key) if shared_target else None
+            if rendered is None:
+                ready, activated = yield from before()
+                if not ready:
+                    return
+                action: Action = yield Step.Call(action_for_target, (message, payload))
+                rendered = (yield Step.Render(action)) if action else ''
+                if shared_target:
+                    rendered_actions.set(rendered_key, rendered)
+                if isinstance(activated, Action):
+                    yield Step.SendAction(activated)
+            if rendered:
+                yield Step.SendText(rendered)
+
+
+class BaseConsumer(BroadcastMixin, JsonWebsocketConsumer):
+    authed = True
 
     def __init__(self):
         super(BaseConsumer, self).__init__()
+        self.signature_errors: List[BasePayload] = []
+        self.joined_groups = set()
         attributes = list(filter(lambda attr: not attr.startswith('_') and not attr.startswith('__'), dir(self)))
         classes = list(filter(lambda cls: hasattr(getattr(self, cls), '__base__'), attributes))
         events = list(filter(lambda e: issubclass(getattr(self, e), BaseEvent), classes))
@@ -121,12 +434,19 @@ class BaseConsumer(JsonWebsocketConsumer):
 
     def disconnect(self, code):
         self.before_disconnect()
+        for group_name in list(self.joined_groups):
+            self.leave_group(group_name)
 
     def send_json(self, content, close=False):
         if 'system' in content:
             content.pop('system')
         super(BaseConsumer, self).send_json(content, close)
 
+    def render(self, action: Action) -> str:
+        content = action.to_data()
+        content.pop('system', None)
+        return self.encode_json(content)
+
     def cache_system(self):
         if not self.get_user().is_anonymous:
             cache.set(user_cache_key(self.get_user()), self.get_systems().to_data(), 40 * 60)
@@ -137,10 +457,16 @@ class BaseConsumer(JsonWebsocketConsumer):
     def join_group(self, group_name: str):
         if group_name:
             async_to_sync(self.channel_layer.group_add)(group_name, self.channel_name)
+            self.joined_groups.add(group_name)
+            if not self.get_user().is_anonymous:
+                GroupChannels.add(group_name, self.get_user().id, self.channel_name)
 
     def leave_group(self, group_name: str):
         if group_name:
             async_to_sync(self.channel_layer.group_discard)(group_name, self.channel_name)
+            self.joined_groups.discard(group_name)
+            if not self.get_user().is_anonymous:
+                GroupChannels.discard(group_name, self.get_user().id, self.channel_name)
 
     def get_systems(self) -> ActionSystem:
         return ActionSystem(
@@ -159,101 +485,56 @@ class BaseConsumer(JsonWebsocketConsumer):
 
     def receive_json(self, content, **kwargs):
         if self.broadcast_group:
-            action, error = self.check_signature(lambda: Action(**content, system=self.get_systems()))
-            if error:
-                return
-            if action:
-                action_handler = getattr(self, get_handler_name(action.to_system_data()), None)
-                if action_handler:
-                    action_handler.consumer = self
-                if not action_handler:
-                    self.Error(payload=ResponsePayload.ActionNotExist(), consumer=self)
-                    return
-                async_to_sync(self.channel_layer.group_send)(self.broadcast_group, action.to_system_data())
+            self.run(self.receive_steps(content))
 
     def send_to_group(self, action: Action, group_name: str = None):
         async_to_sync(
             self.channel_layer.group_send
         )(self.broadcast_group if not group_name else group_name, action.to_system_data())
 
-    def check_signature(self, f: Callable):
-        error = False
-        data = None
-        try:
-            data = f()
-        except TypeError as e:
-            if ' missing ' in str(e):
-                required = str(e).split('argument: ')[1].strip().replace("'", '')
-                self.Error(payload=ResponsePayload.PayloadSignatureWrong(required=required), consumer=self)
-                error = True
-            if ' unexpected ' in str(e):
-                unexpected = str(e).split('argument')[1].strip().replace("'", '')
-                self.Error(payload=ResponsePayload.ActionSignatureWrong(unexpected=unexpected), consumer=self)
-                error = True
-        return data, error
-
-    def parse_payload(self, event, payload_type: BasePayload()):
-        payload = BasePayload(**event['payload'])
-        error = False
-        if payload_type:
-            payload, error = self.check_signature(lambda: payload_type(**payload.to_data()))
-        return payload, error
-
     @safe
     def send_broadcast(self, event, action_for_target: Callable = None, action_for_initiator: Callable = None,
                        target=TargetsEnum.for_all, before_send: Callable = None,
-                       system_before_send: Callable = None, payload_type: BasePayload() = None):
-
-        payload, error = self.parse_payload(event, payload_type)
-        if error:
-            return
-
-        message = Message(
-            **payload.to_data(),
-            system=MessageSystem(
-                **ActionSystem(**event['system']).to_data(),
-                receiver_channel=self.channel_name
-            ),
-            user=self.scope['user'],
-            target=target,
-            custom_target_resolver=self.custom_target_resolver
-        )
-
-        if system_before_send:
-            system_before_send()
-
-        if (message.target == TargetsEnum.for_user and not message.target_user) and message.is_initiator:
-            self.Error(payload=ResponsePayload.RecipientNotExist(), consumer=self)
-            return  # Interrupt action for initiator and action for target if recipient not found
-
-        def before():
-            if before_send and not message.before_send_activated:
-                e: Action = before_send(message, payload)
-                message.before_send_activate()
-                if e:
-                    return e
-                return True
-            return False
-
-        if message.is_initiator and action_for_initiator:
-            activated = before()
-            action: Action = action_for_initiator(message, payload)
-            if action:
-                self.send_json(content=action.to_data())
-            if isinstance(activated, Action):
-                self.send_json(content=activated.to_data())
-            if message.before_send_activated and not activated:
-                message.before_send_drop()
-
-        if message.is_target and action_for_target:
-            activated = before()
-            action: Action = action_for_target(message, payload)
-            if action:
-                self.send_json(content=action.to_data())
-            if isinstance(activated, Action):
-                self.send_json(content=activated.to_data())
-            if message.before_send_activated and not activated:
-                message.before_send_drop()
+                       payload_type: BasePayload() = None, shared_target: bool = False):
+        self.run(self.broadcast_steps(
+            event, action_for_target, action_for_initiator, target, before_send, payload_type, shared_target
+        ))
+
+    def send_error(self, payload: BasePayload):
+        """Send error to this socket only, without broadcast"""
+        error = self.Error(consumer=self, payload=payload, trigger=False)
+        self.send_json(content=error(payload).to_data())
+
+    def run(self, steps: Steps):
+        """Run flow steps at consumer thread, step error raised into flow so its cleanup runs"""
+        result, error = None, None
+        while True:
+            try:
+                step = steps.throw(error) if error else steps.send(result)
+            except StopIteration:
+                return
+            try:
+                result, error = self.run_step(step), None
+            except Exception as e:
+                result, error = None, e
+
+    def run_step(self, step):
+        if isinstance(step, (Step.Call, Step.Blocking)):
+            return step.function(*step.args)
+        if isinstance(step, Step.WaitBeforeSend):
+            return step.message.before_send_wait()
+        if isinstance(step, Step.Render):
+            return self.render(step.action)
+        if isinstance(step, Step.SendAction):
+            self.send_json(content=step.action.to_data())
+        elif isinstance(step, Step.SendText):
+            self.send(text_data=step.text)
+        elif isinstance(step, Step.SendError):
+            self.send_error(step.payload)
+        elif isinstance(step, Step.GroupSend):
+            async_to_sync(self.channel_layer.group_send)(step.group, step.data)
+        elif isinstance(step, Step.ChannelSend):
+            async_to_sync(self.channel_layer.send)(step.channel, step.data)
 
     class Error(BaseEvent):
         """Show error message"""
@@ -7,7 +7,7 @@ from functools import wraps
 from hashlib import md5
 from typing import Callable
 
-from channels.generic.websocket import JsonWebsocketConsumer
+from channels.generic.websocket import JsonWebsocketConsumer, AsyncJsonWebsocketConsumer
 
 from .signatures import ResponsePayload, ActionSystem, ActionsEnum, Action, Message, BasePayload
 
@@ -100,20 +100,36 @@ def check_recipient_not_me(f):
     return wrapper
 
 
+def error_content(err: Exception) -> dict:
+    error = f'{err.__class__.__name__}: {str(err)}'
+    traceback.print_exception(*sys.exc_info())
+    tb = traceback.format_exc()
+    lines = re.findall(r'line \d*, ', tb)
+    for line in lines:
+        tb = tb.replace(line, '')
+    tb_hash = md5(tb.encode('utf-8')).hexdigest()
+    return {'error': 'Something wrong', 'error_message': error, 'error_hash': tb_hash}
+
+
 def safe(f: Callable) -> Callable:
     @wraps(f)
     def wrapper(self: JsonWebsocketConsumer, *args, **kwargs):
         try:
             return f(self, *args, **kwargs)
         except Exception as err:
-            error = f'{err.__class__.__name__}: {str(err)}'
-            traceback.print_exception(*sys.exc_info())
-            tb = traceback.format_exc()
-            lines = re.findall(r'line \d*, ', tb)
-            for line in lines:
-                tb = tb.replace(line, '')
-            tb_hash = md5(tb.encode('utf-8')).hexdigest()
-            self.send_json(content={'error': 'Something wrong', 'error_message': error, 'error_hash': tb_hash})
+            self.send_json(content=error_content(err))
+
+    wrapper.__doc__ = f.__doc__
+    return wrapper
+
+
+def async_safe(f: Callable) -> Callable:
+    @wraps(f)
+    async def wrapper(self: AsyncJsonWebsocketConsumer, *args, **kwargs):
+        try:
+            return await f(self, *args, **kwargs)
+        except Exception as err:
+            await self.send_json(content=error_content(err))
 
     wrapper.__doc__ = f.__doc__
     return wrapper
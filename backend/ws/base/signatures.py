@@ -1,6 +1,8 @@
 import dataclasses
 import json
+import time
 from dataclasses import dataclass
+from functools import cached_property
 from typing import Any, Optional
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
@@ -49,6 +51,10 @@ class ResponsePayload:
     class RecipientIsMe(BasePayload):
         message: str = 'You cannot be the recipient'  #: Error message
 
+    @dataclass
+    class BeforeSendTimeout(BasePayload):
+        message: str = 'Action not applied in time, state may be outdated'  #: Error message
+
     @dataclass
     class Error(BasePayload):
         message: str  #: Error message
@@ -152,6 +158,7 @@ class Message:
     to_user_id: int = None  #: Message target user id
     to_username: str = None  #: Message target user username
     custom_target_resolver: dict  #: Custom target resolver
+    before_send_timeout: float = 2  #: Seconds receiver waits for before send run by other receiver
 
     def __init__(self, **kwargs):
         self.__dict__.update(kwargs)
@@ -172,11 +179,13 @@ class Message:
     def is_initiator(self):
         return self.system.initiator_channel == self.system.receiver_channel
 
-    @property
+    @cached_property
     def initiator_user(self) -> User:
+        if self.user.id == self.system.initiator_user_id:
+            return self.user
         return User.objects.get(id=self.system.initiator_user_id)
 
-    @property
+    @cached_property
     def target_user(self) -> User:
         # TODO Add extend lookup logic for child Consumer
         if self.to_user_id:
@@ -184,13 +193,26 @@ class Message:
         if self.to_username:
             return User.objects.filter(username=self.to_username).first()
 
-    @property
-    def before_send_activated(self):
-        result = cache.get(f'{self.system.action_id, self.system.initiator_channel}')
-        return result
-
-    def before_send_activate(self):
-        cache.set(f'{self.system.action_id, self.system.initiator_channel}', True, 180)
+    def before_send_acquire(self) -> bool:
+        """Atomically activate before send, True only for first receiver"""
+        return cache.add(f'{self.system.action_id, self.system.initiator_channel}', True, 180)
 
-    def before_send_drop(self):
-        cache.delete(f'{self.system.action_id, self.system.initiator_channel}')
+    @property
+    def before_send_done_key(self) -> str:
+        return f'action-{self.system.action_id}-before-send-done'
+
+    def before_send_complete(self):
+        """Mark before send finished, receivers waiting in :meth:`before_send_wait` continue"""
+        cache.set(self.before_send_done_key, True, 180)
+
+    def before_send_wait(self, interval: float = 0.01) -> bool:
+        """
+        Wait until receiver acquired before send finishes it, so actions rendered after its changes,
+        False if not finished in :attr:`before_send_timeout`
+        """
+        deadline = time.monotonic() + self.before_send_timeout
+        while not cache.get(self.before_send_done_key):
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(interval)
+        return True
@@ -33,9 +33,27 @@ def snake_to_camel(name):
     return components[0] + ''.join(x.title() for x in components[1:])
 
 
+def find_value(data, *keys):
+    """First value of any key in nested dict"""
+    if not isinstance(data, dict):
+        return None
+    for key in keys:
+        if data.get(key) is not None:
+            return data[key]
+    for value in data.values():
+        found = find_value(value, *keys)
+        if found is not None:
+            return found
+    return None
+
+
 def user_cache_key(user: User):
     return f'user-{user.id}'
 
 
+def action_cache_key(action_id: str, name: str):
+    return f'action-{action_id}-{name}'
+
+
 def get_system_cache(user: User):
     return cache.get(user_cache_key(user), {})
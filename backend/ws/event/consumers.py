@@ -30,12 +30,14 @@ class EventRetrieveConsumer(PlayerConsumer):
         self.event_id = event.id
         self.broadcast_group = f'event-{event.id}'
         self.join_group(self.broadcast_group)
+        self.attach_session(event.player_session)
         self.Session(consumer=self)
 
     class EventChanged(BaseEvent):
         request_payload_type = RequestPayload.ModifyEvent
         target = TargetsEnum.for_all
         hidden = True
+        shared_target = True
 
         @get_event
         def action_for_target(self, message: Message, payload: request_payload_type, event: Event):
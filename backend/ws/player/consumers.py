@@ -1,21 +1,20 @@
-from typing import Union
+from typing import Optional, Union
+
+from django.core.cache import cache
 
 from music_room.models import PlayerSession, Playlist
-from music_room.serializers import PlayerSessionSerializer
+from music_room.serializers import PlayerSessionSerializer, PlayerSessionPatchSerializer
+from music_room.services.access import AccessService
 from music_room.services.player import PlayerService
-from ws.base import TargetsEnum, Message, BaseEvent, camel_to_dot, ActionSystem
+from music_room.services.queue import QueueEngine
+from ws.base import TargetsEnum, Message, BaseEvent, camel_to_dot, ActionSystem, action_cache_key
 from ws.utils import ActionRef as Action, BaseConsumerRef as BaseConsumer
 from .decorators import restore_player_session, check_player_session, get_player_service, get_playlist
 from .signatures import RequestPayload, ResponsePayload, CustomTargetEnum, RequestPayloadWrap
 
 
 def for_accessed(message: Union[Message, RequestPayload.ModifyTrack]):
-    player_session = PlayerSession.objects.get(id=message.player_session_id)
-    if player_session.playlist.access_type == Playlist.AccessTypes.public:
-        return True
-    if message.user in player_session.playlist.playlist_access_users.values_list('id', flat=True):
-        return True
-    return False
+    return AccessService.is_accessed(message.player_session_id, message.user)
 
 
 class PlayerConsumer(BaseConsumer):
@@ -23,6 +22,7 @@ class PlayerConsumer(BaseConsumer):
     authed = True
     custom_target_resolver = {CustomTargetEnum.for_accessed: for_accessed}
     multiplayer = False
+    attached_session_id: Optional[int] = None  #: Player session which queue engine kept for this consumer
 
     request_type_resolver = {
         'create_session': RequestPayloadWrap.CreateSession,
@@ -33,16 +33,25 @@ class PlayerConsumer(BaseConsumer):
         'pause_track': RequestPayloadWrap.PauseTrack,
         'resume_track': RequestPayloadWrap.ResumeTrack,
         'stop_track': RequestPayloadWrap.StopTrack,
+        'session_snapshot': RequestPayloadWrap.SessionSnapshot,
     }
 
     @restore_player_session
     def after_connect(self, player_session: PlayerSession):
+        self.attach_session(player_session)
         self.Session(consumer=self)
 
     @restore_player_session
     def before_disconnect(self, player_session: PlayerSession):
         if player_session:
             PlayerService(player_session).freeze_session()
+        if self.attached_session_id:
+            QueueEngine.detach(self.attached_session_id)
+
+    def attach_session(self, player_session: Optional[PlayerSession]):
+        if player_session:
+            self.attached_session_id = player_session.id
+            QueueEngine.attach(player_session.id)
 
     class Session(BaseEvent):
         request_payload_type = None
@@ -68,9 +77,11 @@ class PlayerConsumer(BaseConsumer):
         def action_for_initiator(self, message: Message, payload: request_payload_type, playlist: Playlist):
             player_session = PlayerSession.objects.create(playlist=playlist, author=message.initiator_user)
             if payload.shuffle:
-                player_session = PlayerService(player_session)
-                player_session.shuffle()
-                player_session = player_session.player_session
+                player_service = PlayerService(player_session)
+                with player_service.locked():
+                    player_service.shuffle()
+                    # Snapshot already shuffled, seed must not be sent again with next patch
+                    player_service.commit()
             return Action(
                 event=str(EventsList.session_changed),
                 payload=ResponsePayload.PlayerSession(
@@ -85,32 +96,57 @@ class PlayerConsumer(BaseConsumer):
         def before_send(self, message: Message, payload: request_payload_type):
             PlayerSession.objects.filter(author=message.initiator_user).delete()
 
-    class SessionChanged(BaseEvent):
+    class SessionSnapshot(BaseEvent):
+        """Get whole player session, e.g. when patch previous version not matched with already received"""
         request_payload_type = RequestPayload.ModifyTrack
-        target = CustomTargetEnum.for_accessed
-        hidden = True
+        response_payload_type = ResponsePayload.PlayerSession
+        target = TargetsEnum.only_for_initiator
 
         @check_player_session
-        def action_for_target(self, message: Message, payload: request_payload_type):
-            action = Action(
-                event=str(EventsList.session_changed),
+        def action_for_initiator(self, message: Message, payload: request_payload_type):
+            return Action(
+                event=str(EventsList.session),
                 payload=ResponsePayload.PlayerSession(
                     player_session=PlayerSessionSerializer(
                         PlayerService(payload.player_session_id).player_session).data).to_data(),
                 system=self.event['system']
             )
-            return action
 
-        @check_player_session
-        def action_for_initiator(self, message: Message, payload: request_payload_type):
-            action = Action(
+    class SessionPatched(BaseEvent):
+        """Player session queue changes, sent instead of whole session after any track modify"""
+        request_payload_type = None
+        response_payload_type = ResponsePayload.PlayerSessionPatch
+        hidden = True
+
+    class SessionChanged(BaseEvent):
+        request_payload_type = RequestPayload.ModifyTrack
+        target = CustomTargetEnum.for_accessed
+        hidden = True
+        shared_target = True
+
+        def session(self, message: Message, payload: request_payload_type):
+            patch = cache.get(action_cache_key(message.system.action_id, 'patch'))
+            if patch:
+                return Action(
+                    event=str(EventsList.session_patched),
+                    payload=ResponsePayload.PlayerSessionPatch(player_session_patch=patch).to_data(),
+                    system=self.event['system']
+                )
+            return Action(
                 event=str(EventsList.session_changed),
                 payload=ResponsePayload.PlayerSession(
                     player_session=PlayerSessionSerializer(
                         PlayerService(payload.player_session_id).player_session).data).to_data(),
                 system=self.event['system']
             )
-            return action
+
+        @check_player_session
+        def action_for_target(self, message: Message, payload: request_payload_type):
+            return self.session(message, payload)
+
+        @check_player_session
+        def action_for_initiator(self, message: Message, payload: request_payload_type):
+            return self.session(message, payload)
 
     class PlayTrack(SessionChanged, BaseEvent):
         """Play track by id, or current track if id not provided"""
@@ -157,15 +193,15 @@ class PlayerConsumer(BaseConsumer):
             player_service.play_previous()
 
     class Shuffle(SessionChanged, BaseEvent):
-        """Shuffle tracks for current player session"""
-        request_payload_type = RequestPayload.ModifyTrack
+        """Shuffle tracks for current player session, seed of shuffle sent with session patch"""
+        request_payload_type = RequestPayload.Shuffle
         response_payload_type_initiator = ResponsePayload.PlayerSession
         response_payload_type_target = ResponsePayload.PlayerSession
         hidden = False
 
         @get_player_service
         def before_send(self, message: Message, payload: request_payload_type, player_service: PlayerService):
-            player_service.shuffle()
+            player_service.shuffle(payload.seed)
 
     class PauseTrack(SessionChanged, BaseEvent):
         """Pause current played track for current player session"""
@@ -201,7 +237,7 @@ class PlayerConsumer(BaseConsumer):
             player_service.stop_track()
 
     class SyncTrack(BaseEvent):
-        """Sync current track progress from duration for current player session"""
+        """Correct server playback clock of current player session, progress drift within tolerance ignored"""
         request_payload_type = RequestPayload.SyncTrack
 
         @get_player_service
@@ -223,6 +259,8 @@ class PlayerConsumer(BaseConsumer):
 class EventsList:
     session: PlayerConsumer.Session = camel_to_dot(PlayerConsumer.Session.__name__)
     session_changed: PlayerConsumer.SessionChanged = camel_to_dot(PlayerConsumer.SessionChanged.__name__)
+    session_patched: PlayerConsumer.SessionPatched = camel_to_dot(PlayerConsumer.SessionPatched.__name__)
+    session_snapshot: PlayerConsumer.SessionSnapshot = camel_to_dot(PlayerConsumer.SessionSnapshot.__name__)
     create_session: PlayerConsumer.CreateSession = camel_to_dot(PlayerConsumer.CreateSession.__name__)
     remove_session: PlayerConsumer.RemoveSession = camel_to_dot(PlayerConsumer.RemoveSession.__name__)
     play_track: PlayerConsumer.PlayTrack = camel_to_dot(PlayerConsumer.PlayTrack.__name__)
@@ -250,6 +288,19 @@ class Examples:
         system=ActionSystem()
     ).to_data(pop_system=True, to_json=True)
 
+    session_patched_response = Action(
+        event=str(EventsList.session_patched),
+        payload=ResponsePayload.PlayerSessionPatch(
+            player_session_patch=PlayerSessionPatchSerializer(None).data).to_data(),
+        system=ActionSystem()
+    ).to_data(pop_system=True, to_json=True)
+
+    session_snapshot_request = Action(
+        event=str(EventsList.session_snapshot),
+        payload=RequestPayload.ModifyTrack(player_session_id=1).to_data(),
+        system=ActionSystem()
+    ).to_data(pop_system=True, to_json=True)
+
     create_session_request = Action(
         event=str(EventsList.create_session),
         payload=RequestPayload.CreateSession(playlist_id=1, shuffle=True).to_data(),
@@ -288,7 +339,7 @@ class Examples:
 
     shuffle_request = Action(
         event=str(EventsList.shuffle),
-        payload=RequestPayload.ModifyTrack(player_session_id=1).to_data(),
+        payload=RequestPayload.Shuffle(player_session_id=1, seed=42).to_data(),
         system=ActionSystem()
     ).to_data(pop_system=True, to_json=True)
 
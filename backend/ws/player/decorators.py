@@ -1,10 +1,12 @@
 from typing import Callable, Union
 
+from django.core.cache import cache
 from django.db.models import Q
 
 from music_room.models import PlayerSession, Playlist, Event
+from music_room.serializers import PlayerSessionPatchSerializer
 from music_room.services import PlayerService
-from ws.base import BaseEvent, BaseConsumer, Message
+from ws.base import BaseEvent, BaseConsumer, Message, action_cache_key
 from ws.utils import ActionRef as Action
 
 
@@ -17,7 +19,16 @@ def get_player_service(f: Callable):
         player_session = PlayerService(payload.player_session_id)
         if not player_session.player_session:
             return Action(event='error', payload={'message': 'Session not found'}, system=message.system.to_data())
-        return f(self, message, payload, player_session, *args)
+        with player_session.locked():
+            result = f(self, message, payload, player_session, *args)
+            patch = player_session.commit()
+        if patch:
+            cache.set(
+                action_cache_key(message.system.action_id, 'patch'),
+                PlayerSessionPatchSerializer(patch).data,
+                180
+            )
+        return result
 
     return wrapper
 
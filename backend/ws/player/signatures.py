@@ -21,6 +21,11 @@ class RequestPayload:
         player_session_id: int  #: Already started player session id
         track_id: int  #: Track id for push top of queue
 
+    @dataclass
+    class Shuffle(BasePayload):
+        player_session_id: int  #: Already started player session id
+        seed: Optional[int] = None  #: Optional, shuffle seed for reproducible order, random if not provided
+
     @dataclass
     class CreateSession(BasePayload):
         playlist_id: int  #: Already created playlist id
@@ -55,7 +60,7 @@ class RequestPayloadWrap:
 
     @dataclass
     class Shuffle(BasePayload):
-        shuffle: Union[RequestPayload.ModifyTrack, dict]  #: Shuffle tracks signature mock for swift
+        shuffle: Union[RequestPayload.Shuffle, dict]  #: Shuffle tracks signature mock for swift
 
     @dataclass
     class PauseTrack(BasePayload):
@@ -73,6 +78,10 @@ class RequestPayloadWrap:
     class SyncTrack(BasePayload):
         sync_track: Union[RequestPayload.SyncTrack, dict]  #: Sync track signature mock for swift
 
+    @dataclass
+    class SessionSnapshot(BasePayload):
+        session_snapshot: Union[RequestPayload.ModifyTrack, dict]  #: Session snapshot signature mock for swift
+
     @dataclass
     class Error(BasePayload):
         error: Union[BaseResponsePayload.Error, dict]  #: Error signature mock for swift
@@ -87,6 +96,11 @@ class ResponsePayload:
     class PlayerSession(BasePayload):
         player_session: PlayerSession  #: player session object
 
+    @dataclass
+    class PlayerSessionPatch(BasePayload):
+        #: Queue changes with session version, request session snapshot if previous version not matched
+        player_session_patch: dict
+
 
 class CustomTargetEnum(TargetsEnum):
     """Who must receive this event"""
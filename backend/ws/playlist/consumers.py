@@ -1,14 +1,17 @@
+from channels.db import database_sync_to_async
+
 from music_room.models import Playlist as PlaylistModel, Track, Playlist
 from music_room.serializers import PlaylistSerializer
 from ws.base import TargetsEnum, Message, BaseEvent, ActionSystem
-from ws.utils import ActionRef as Action, BaseConsumerRef as BaseConsumer
+from ws.utils import ActionRef as Action, BaseConsumerRef as BaseConsumer, AsyncBaseConsumerRef as AsyncBaseConsumer, \
+    AsyncBaseEventRef as AsyncBaseEvent
 from music_room.services import PlaylistService
 from .decorators import get_playlist_from_path, get_playlist, only_for_author
 from .signatures import RequestPayload, ResponsePayload, RequestPayloadWrap
 from ws.base.utils import camel_to_dot
 
 
-class PlaylistsConsumer(BaseConsumer):
+class PlaylistsConsumer(AsyncBaseConsumer):
     broadcast_group = 'playlist'
     authed = True
 
@@ -18,26 +21,30 @@ class PlaylistsConsumer(BaseConsumer):
         'remove_playlist': RequestPayloadWrap.RemovePlaylist,
     }
 
-    class PlaylistsChanged(BaseEvent):
+    class PlaylistsChanged(AsyncBaseEvent):
         request_payload_type = RequestPayload.ModifyPlaylists
         hidden = True
 
-        def action_for_initiator(self, message: Message, payload: request_payload_type):
+        async def action_for_initiator(self, message: Message, payload: request_payload_type):
+            playlists = await database_sync_to_async(
+                lambda: PlaylistSerializer(PlaylistSerializer.prefetch(message.user.playlists.all()), many=True).data
+            )()
             action = Action(
                 event=str(EventsList.playlists_changed),
                 payload=ResponsePayload.PlaylistsChanged(
-                    playlists=PlaylistSerializer(message.user.playlists.all(), many=True).data,
+                    playlists=playlists,
                 ).to_data(),
                 system=self.event['system']
             )
             return action
 
-    class ChangePlaylist(PlaylistsChanged, BaseEvent):
+    class ChangePlaylist(PlaylistsChanged, AsyncBaseEvent):
         """Change already existed playlist"""
         request_payload_type = RequestPayload.ModifyPlaylist
         response_payload_type_initiator = ResponsePayload.PlaylistsChanged
         hidden = False
 
+        @database_sync_to_async
         def before_send(self, message: Message, payload: request_payload_type):
             playlist = PlaylistService(payload.playlist_id)
             playlist.change(
@@ -45,12 +52,13 @@ class PlaylistsConsumer(BaseConsumer):
                 access_type=payload.playlist_access_type
             )
 
-    class AddPlaylist(PlaylistsChanged, BaseEvent):
+    class AddPlaylist(PlaylistsChanged, AsyncBaseEvent):
         """Add new playlist"""
         request_payload_type = RequestPayload.ModifyPlaylists
         response_payload_type_initiator = ResponsePayload.PlaylistsChanged
         hidden = False
 
+        @database_sync_to_async
         def before_send(self, message: Message, payload: request_payload_type):
             PlaylistModel.objects.create(
                 name=payload.playlist_name,
@@ -58,12 +66,13 @@ class PlaylistsConsumer(BaseConsumer):
                 author=message.initiator_user
             )
 
-    class RemovePlaylist(PlaylistsChanged, BaseEvent):
+    class RemovePlaylist(PlaylistsChanged, AsyncBaseEvent):
         """Remove already created playlist"""
         request_payload_type = RequestPayload.ModifyPlaylist
         response_payload_type_initiator = ResponsePayload.PlaylistsChanged
         hidden = False
 
+        @database_sync_to_async
         def before_send(self, message: Message, payload: request_payload_type):
             PlaylistModel.objects.get(id=payload.playlist_id).delete()
 
@@ -75,6 +84,7 @@ class PlaylistRetrieveConsumer(BaseConsumer):
     request_type_resolver = {
         'add_track': RequestPayloadWrap.AddTrack,
         'remove_track': RequestPayloadWrap.RemoveTrack,
+        'move_track': RequestPayloadWrap.MoveTrack,
         'invite_to_playlist': RequestPayloadWrap.InviteToPlaylist,
         'revoke_from_playlist': RequestPayloadWrap.RevokeFromPlaylist,
     }
@@ -91,6 +101,7 @@ class PlaylistRetrieveConsumer(BaseConsumer):
         change_message = None
         target = TargetsEnum.for_all
         hidden = True
+        shared_target = True
 
         def playlist(self, message: Message, payload: request_payload_type, playlist: PlaylistModel):
             action = Action(event=str(EventsList.playlist_changed), system=self.event['system'])
@@ -137,6 +148,19 @@ class PlaylistRetrieveConsumer(BaseConsumer):
             playlist = PlaylistService(playlist.id)
             playlist.remove_track(payload.track_id)
 
+    class MoveTrack(PlaylistChanged, BaseEvent):
+        """Move track to position at already existed playlist, only moved track order changed while gap exists"""
+        request_payload_type = RequestPayload.MoveTrack
+        change_message = '{} move track {} at playlist'
+        response_payload_type_target = ResponsePayload.PlaylistChanged
+        response_payload_type_initiator = ResponsePayload.PlaylistChanged
+        hidden = False
+
+        @get_playlist
+        def before_send(self, message: Message, payload: request_payload_type, playlist: PlaylistModel):
+            playlist = PlaylistService(playlist.id)
+            playlist.move_track(payload.track_id, payload.position)
+
     class InviteToPlaylist(BaseEvent):
         """Invite someone to access this playlist"""
         request_payload_type = RequestPayload.ModifyPlaylistAccess
@@ -167,6 +191,7 @@ class EventsList:
     remove_playlist: PlaylistsConsumer.RemovePlaylist = camel_to_dot(PlaylistsConsumer.RemovePlaylist.__name__)
     add_track: PlaylistRetrieveConsumer.AddTrack = camel_to_dot(PlaylistRetrieveConsumer.AddTrack.__name__)
     remove_track: PlaylistRetrieveConsumer.RemoveTrack = camel_to_dot(PlaylistRetrieveConsumer.RemoveTrack.__name__)
+    move_track: PlaylistRetrieveConsumer.MoveTrack = camel_to_dot(PlaylistRetrieveConsumer.MoveTrack.__name__)
     invite_to_playlist: PlaylistRetrieveConsumer.InviteToPlaylist = camel_to_dot(
         PlaylistRetrieveConsumer.InviteToPlaylist.__name__)
     revoke_from_playlist: PlaylistRetrieveConsumer.RevokeFromPlaylist = camel_to_dot(
@@ -226,6 +251,12 @@ class Examples:
         system=ActionSystem()
     ).to_data(pop_system=True, to_json=True)
 
+    move_track_request = Action(
+        event=str(EventsList.move_track),
+        payload=RequestPayload.MoveTrack(track_id=1, position=0).to_data(),
+        system=ActionSystem()
+    ).to_data(pop_system=True, to_json=True)
+
     invite_to_playlist_request = Action(
         event=str(EventsList.invite_to_playlist),
         payload=RequestPayload.ModifyPlaylistAccess(user_id=1).to_data(),
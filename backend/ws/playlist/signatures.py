@@ -11,6 +11,11 @@ class RequestPayload:
         """Modify playlist tracks"""
         track_id: int  #: Track if for any actions with it (eg. remove, add)
 
+    @dataclass
+    class MoveTrack(ModifyPlaylistTracks):
+        """Move playlist track"""
+        position: int  #: Track position in playlist after move, starts from 0
+
     @dataclass
     class ModifyPlaylist(BasePayload):
         """Modify playlist"""
@@ -56,6 +61,11 @@ class RequestPayloadWrap:
         #: Remove track from playlist signature mock for swift
         remove_track: Union[RequestPayload.ModifyPlaylistTracks, dict]
 
+    @dataclass
+    class MoveTrack(BasePayload):
+        #: Move track at playlist signature mock for swift
+        move_track: Union[RequestPayload.MoveTrack, dict]
+
     @dataclass
     class InviteToPlaylist(BasePayload):
         #: Invite someone to access this playlist mock for swift
@@ -1,7 +1,7 @@
 from typing import Callable
 
 from ws.base import Action, BaseConsumer, dot_to_camel, snake_to_camel, BasePayload, camel_to_snake, dot_to_snake, \
-    BaseEvent, Message, ResponsePayload
+    BaseEvent, Message, ResponsePayload, AsyncBaseConsumer, AsyncBaseEvent
 
 
 def dict_key_reformat(data: dict, reformat_func: Callable):
@@ -40,7 +40,11 @@ class BaseEventRef(BaseEvent):
         return ActionRef(event=event.pop('type'), system=event.pop('system'), payload={self.event_name: payload})
 
 
-class BaseConsumerRef(BaseConsumer):
+class AsyncBaseEventRef(AsyncBaseEvent, BaseEventRef):
+    ...
+
+
+class PayloadRefMixin:
     request_type_resolver = {}
 
     def parse_payload(self, event, payload_type: BasePayload()):
@@ -65,9 +69,20 @@ class BaseConsumerRef(BaseConsumer):
             payload, error = parse(lambda: payload_type(**payload.to_data()))
         return payload, error
 
+
+class BaseConsumerRef(PayloadRefMixin, BaseConsumer):
     class Error(BaseEventRef):
         """Show error message"""
         request_payload_type = ResponsePayload.Error
 
         def action_for_initiator(self, message: Message, payload: request_payload_type):
             return self(payload=ResponsePayload.Error(message=payload.message))
+
+
+class AsyncBaseConsumerRef(PayloadRefMixin, AsyncBaseConsumer):
+    class Error(AsyncBaseEventRef):
+        """Show error message"""
+        request_payload_type = ResponsePayload.Error
+
+        async def action_for_initiator(self, message: Message, payload: request_payload_type):
+            return self(payload=ResponsePayload.Error(message=payload.message))